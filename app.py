@@ -2,23 +2,26 @@ import dash
 from dash import Dash, callback, html, dcc, dash_table
 import dash_bootstrap_components as dbc
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import dash.dash_table.FormatTemplate as FormatTemplate
 from dash.dash_table.Format import Format, Scheme, Sign
 import numpy as np
 import pandas as pd
 import matplotlib as mpl
 import gunicorn                     
+from flask import jsonify
 from whitenoise import WhiteNoise
 
 from plotting import(
-    plot_sector_data, 
-    plot_metric, 
-    plot_macroeconomic_data,
+    get_sector_figure,
+    get_metric_figure,
+    get_macroeconomic_figure,
     plot_sector_weightings,
     plot_sector_risk_returns)
 
-from load_data import ETF_TO_SECTOR, create_watchlist_df
+from load_data import ETF_TO_SECTOR, get_watchlist_page
+from database import get_pool_stats
+from cache import get_cache_stats
 
 # Instantiate dash app
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
@@ -27,6 +30,16 @@ server = app.server
 # Whitenoise --> serving static files from Heroku (not used)
 server.wsgi_app = WhiteNoise(server.wsgi_app, root='static/') 
 
+# Database pool usage for the worker serving the request, used to size DB_POOL_SIZE
+@server.route('/stats/db-pool')
+def db_pool_stats():
+    return jsonify(get_pool_stats())
+
+# Per-function hit/miss counts of the in-process and memcached tiers for the worker serving the request
+@server.route('/stats/cache')
+def cache_stats():
+    return jsonify(get_cache_stats())
+
 # Define the layout of the dashboard
 app.layout = dbc.Container(
     fluid=True,
@@ -181,6 +194,8 @@ app.layout = dbc.Container(
                     dbc.Card(
                         [
                             dbc.CardHeader("Watchlist"),
+                            # Sector ETF (or 'all') the watchlist shows, only changes when the industry does
+                            dcc.Store(id='watchlist-sector', data='all'),
                             dbc.CardBody(
                                 dash_table.DataTable(
                                     id='watchlist-table',
@@ -281,10 +296,12 @@ app.layout = dbc.Container(
                                     fixed_columns={'headers': True, 'data': 1},
 
                                     #filter_action="native",
-                                    sort_action="native",
+                                    sort_action="custom",
                                     sort_mode= 'single',
+                                    sort_by=[],
                                     #row_selectable='multi',
-                                    page_action='native',
+                                    page_action='custom',
+                                    page_current=0,
                                     page_size = 50
                                 ),
                                 style={"height": "100%", "width": "100%", "padding": "0"}
@@ -365,12 +382,10 @@ app.layout = dbc.Container(
 # Callback for ETF graph
 # Returns graph-2 based on the selected metric, active tab, rolling average, graph type, and timeframe
 # Returns metric-dropdown options and value based on the active tab
-# Returns watchlist-table data based on the active tab and selected industry
 @app.callback(
     [Output("graph-2", "figure"),
      Output("metric-dropdown", "options"),
-     Output("metric-dropdown", "value"),
-     Output("watchlist-table", "data")],
+     Output("metric-dropdown", "value")],
     [Input("metric-dropdown", "value"),
      Input("card-tabs", "active_tab"),
      Input("rolling-average-radios", "value"),
@@ -406,11 +421,48 @@ def update_etf_graph(metric, active_tab, rolling_average, graph_type, num_years)
     if(active_tab == "tab-1"):
         if(metric == None or metric in ETF_TO_SECTOR.keys()):
             metric = 'Year-End Indexed Price'
-        return plot_metric(metric, num_years, rolling_average, graph_type == "bar"), metric_options, metric, create_watchlist_df().to_dict('records')
+        return get_metric_figure(metric, num_years, rolling_average, graph_type == "bar"), metric_options, metric
     else:
         if(metric == None or metric not in ETF_TO_SECTOR.keys()):
             metric = 'XLE'
-        return plot_sector_data(metric, num_years, rolling_average), eft_options, metric, create_watchlist_df(metric).to_dict('records')
+        return get_sector_figure(metric, num_years, rolling_average), eft_options, metric
+
+# Callback for the watchlist sector
+# Returns the sector ETF shown in the watchlist based on the active tab and selected industry
+# Leaves watchlist-sector untouched when only the Market Overview metric changes
+@app.callback(
+    Output("watchlist-sector", "data"),
+    [Input("card-tabs", "active_tab"),
+     Input("metric-dropdown", "value")],
+    [State("watchlist-sector", "data")]
+)
+def update_watchlist_sector(active_tab, metric, current_sector):
+    if(active_tab == "tab-1"):
+        sector_ticker = 'all'
+    else:
+        sector_ticker = metric if metric in ETF_TO_SECTOR.keys() else 'XLE'
+    if(sector_ticker == current_sector):
+        return dash.no_update
+    return sector_ticker
+
+# Callback for the watchlist
+# Returns the visible watchlist-table page, sorted server side, for the selected sector
+# Goes back to the first page when the sector changes
+@app.callback(
+    [Output("watchlist-table", "data"),
+     Output("watchlist-table", "page_count"),
+     Output("watchlist-table", "page_current")],
+    [Input("watchlist-table", "page_current"),
+     Input("watchlist-table", "page_size"),
+     Input("watchlist-table", "sort_by"),
+     Input("watchlist-sector", "data")]
+)
+def update_watchlist_page(page_current, page_size, sort_by, sector_ticker):
+    if(dash.callback_context.triggered_id == "watchlist-sector"):
+        page_current = 0
+
+    data, page_count = get_watchlist_page(sector_ticker, sort_by, page_current, page_size)
+    return data, page_count, min(page_current or 0, page_count - 1)
     
 # Callback for Macro graph
 # Returns graph-4 based on the selected tab, maturity (interest rates), and timeframe
@@ -430,9 +482,9 @@ def update_macro_graph(active_tab, value, num_years):
                 'tab-8': 'debt_financial'}
     
     if(active_tab == 'tab-5'):
-        return plot_macroeconomic_data(tab_dict[active_tab], num_years, maturity = value), False
+        return get_macroeconomic_figure(tab_dict[active_tab], num_years, maturity = value), False
     
-    return plot_macroeconomic_data(tab_dict[active_tab], num_years), True
+    return get_macroeconomic_figure(tab_dict[active_tab], num_years), True
 
 # Callback for the overview graphs
 # Returns graph-1 based on the active tab
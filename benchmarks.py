@@ -0,0 +1,156 @@
+import io
+import time
+import zlib
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+from plotly.io.json import to_json_plotly
+
+from cache import encode_frame, decode_frame
+from database import db_connection, save_to_db
+from load_data import load_etf_df
+from plotting import plot_line_graph, plot_bar_graph, plot_sector_graph, plot_macro_graph
+from utilities import MACRO_TRACE_DICT
+
+#Benchmarks for the data layer, run against the database configured by the MY_DB_* variables (use a local Postgres)
+def make_benchmark_df(num_rows, start_date='2000-01-03'):
+    index = pd.bdate_range(start=start_date, periods=num_rows)
+    rng = np.random.default_rng(0)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, num_rows)))
+    return pd.DataFrame({
+        'close': close,
+        'volatility': rng.uniform(5, 40, num_rows),
+        'div_yield': rng.uniform(0, 0.01, num_rows),
+        'rsi': rng.uniform(0, 100, num_rows),
+        'sharpe': rng.normal(0, 1, num_rows),
+        'ytd_pct': rng.normal(0, 10, num_rows),
+    }, index=index)
+
+def drop_table(table_name):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {table_name};")
+        cur.close()
+
+# Compares rows/second of the row-by-row insert against the COPY upsert
+def benchmark_save_to_db(num_rows=5000):
+    df = make_benchmark_df(num_rows)
+    results = {}
+    for method, on_conflict in [('rows', 'skip'), ('copy', 'skip'), ('copy', 'update')]:
+        table_name = f'benchmark_save_{method}_{on_conflict}'
+        drop_table(table_name)
+        start = time.perf_counter()
+        save_to_db(df, table_name, method=method, on_conflict=on_conflict)
+        elapsed = time.perf_counter() - start
+        drop_table(table_name)
+        results[f'{method}/{on_conflict}'] = num_rows / elapsed
+        print(f"save_to_db {method}/{on_conflict}: {num_rows} rows in {elapsed:.2f}s ({num_rows / elapsed:,.0f} rows/s)")
+    return results
+
+# Compares the pd.read_sql reader against the binary COPY reader for a metric across num_tickers tables
+def benchmark_load_etf_df(num_tickers=12, num_years=5, repeats=20):
+    tickers = [f'benchmark_load_{i}' for i in range(num_tickers)]
+    for ticker in tickers:
+        drop_table(ticker)
+        save_to_db(make_benchmark_df(252 * num_years), ticker)
+
+    results = {}
+    for reader in ['pandas', 'binary']:
+        for label, args in [('close', ('close', tickers)), ('all', ('all', tickers[:1]))]:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                load_etf_df(*args, reader=reader)
+            elapsed = (time.perf_counter() - start) / repeats
+            results[f'{reader}/{label}'] = elapsed
+            print(f"load_etf_df {reader} '{label}': {elapsed * 1000:.1f} ms per call")
+
+    for ticker in tickers:
+        drop_table(ticker)
+    return results
+
+# Watchlist-shaped frame: text columns plus numeric columns where missing values are the string 'N/A'
+def make_watchlist_benchmark_df(num_rows=500):
+    rng = np.random.default_rng(0)
+    def with_missing(values):
+        return [value if rng.uniform() > 0.05 else 'N/A' for value in values]
+    return pd.DataFrame({
+        'Ticker': [f'T{i}' for i in range(num_rows)],
+        'Name': [f'Company {i} Inc.' for i in range(num_rows)],
+        'Sector': rng.choice(['Technology', 'Healthcare', 'Energy', 'Utilities'], num_rows),
+        'Market Cap': with_missing(rng.integers(10**9, 10**12, num_rows).tolist()),
+        'Price': with_missing(rng.uniform(5, 500, num_rows)),
+        'PE Ratio': with_missing(rng.uniform(5, 60, num_rows)),
+        '%-Change (1M)': rng.normal(0, 5, num_rows),
+        '%-Change (6M)': rng.normal(0, 15, num_rows),
+    })
+
+# Compares encode/decode time and payload size of the CSV cache format against the binary codec in cache.py
+# CSV sizes are shown raw and after the zlib pass bmemcached applies to large values
+def benchmark_cache_codec(repeats=50):
+    # frame name -> (frame, whether the CSV reader has to parse the index as dates)
+    frames = {
+        'macro': (make_benchmark_df(252 * 5), True),
+        'watchlist': (make_watchlist_benchmark_df(), False),
+    }
+
+    results = {}
+    for frame_name, (df, parse_dates) in frames.items():
+        codecs = {
+            'csv': (lambda df: df.to_csv(index=True),
+                    lambda payload: pd.read_csv(io.StringIO(payload), index_col=0, parse_dates=parse_dates)),
+            'binary': (encode_frame, decode_frame),
+        }
+        for codec_name, (encode, decode) in codecs.items():
+            start = time.perf_counter()
+            for _ in range(repeats):
+                payload = encode(df)
+            encode_time = (time.perf_counter() - start) / repeats
+            start = time.perf_counter()
+            for _ in range(repeats):
+                decode(payload)
+            decode_time = (time.perf_counter() - start) / repeats
+
+            size = len(payload.encode() if isinstance(payload, str) else payload)
+            stored_size = len(zlib.compress(payload.encode())) if isinstance(payload, str) else size
+            results[f'{frame_name}/{codec_name}'] = (encode_time, decode_time, stored_size)
+            print(f"cache codec {frame_name} {codec_name}: encode {encode_time * 1000:.2f} ms, decode {decode_time * 1000:.2f} ms, "
+                  f"{size:,} bytes ({stored_size:,} stored)")
+    return results
+
+# Figure assembly for one callback: the figure dict serialized as is, against building a go.Figure from it first,
+# which runs the property validation the old add_trace/update_layout code paid for
+def benchmark_figure_builders(num_years=5, repeats=20):
+    df = make_benchmark_df(252 * num_years)
+    tickers = ['XLB', 'XLC', 'XLE', 'XLF', 'XLI', 'XLK', 'XLP', 'XLRE', 'XLU', 'XLV', 'XLY', 'S&P 500']
+    metric_df = pd.DataFrame({ticker: df['close'] * (1 + position / 100) for position, ticker in enumerate(tickers)})
+    lines = [trace for trace in MACRO_TRACE_DICT['interest_rates'] if not trace.bar]
+    macro_df = pd.DataFrame({trace.name: df['sharpe'] + position for position, trace in enumerate(lines)})
+
+    figures = {
+        'metric line': lambda: plot_line_graph(metric_df, 'Price'),
+        'metric bar': lambda: plot_bar_graph(metric_df, 'Price'),
+        'sector': lambda: plot_sector_graph(df, 'XLK'),
+        'macro': lambda: plot_macro_graph(macro_df, 'interest_rates', lines, []),
+    }
+    builders = {
+        'dict': lambda build: to_json_plotly(build()),
+        'go.Figure': lambda build: go.Figure(build()).to_json(),
+    }
+
+    results = {}
+    for figure_name, build in figures.items():
+        for builder_name, render in builders.items():
+            start = time.perf_counter()
+            for _ in range(repeats):
+                render(build)
+            elapsed = (time.perf_counter() - start) / repeats
+            results[f'{figure_name}/{builder_name}'] = elapsed
+            print(f"figure {figure_name} {builder_name}: {elapsed * 1000:.1f} ms per build")
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_save_to_db()
+    benchmark_load_etf_df()
+    benchmark_cache_codec()
+    benchmark_figure_builders()
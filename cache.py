@@ -0,0 +1,360 @@
+import functools
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from time import monotonic, sleep
+import numpy as np
+import pandas as pd
+import bmemcached
+import zstandard
+from dash.exceptions import PreventUpdate
+from flask import g, has_request_context
+
+
+logger = logging.getLogger(__name__)
+
+mc = bmemcached.Client(os.environ.get('MEMCACHEDCLOUD_SERVERS').split(','), os.environ.get('MEMCACHEDCLOUD_USERNAME'), os.environ.get('MEMCACHEDCLOUD_PASSWORD'))
+
+# Cached frames are stored as MAGIC + format version byte + zstd(meta length, JSON meta, column buffers)
+# Entries written by another format (including the old CSV strings) decode as a cache miss
+CACHE_MAGIC = b'ETFC'
+CACHE_FORMAT_VERSION = 1
+CACHE_ZSTD_LEVEL = int(os.environ.get('CACHE_ZSTD_LEVEL', 3))
+
+# A process rebuilding a missing key holds '{key}:lease' (taken with add, so only one process gets it) for at most
+# CACHE_LEASE_TTL seconds. Other processes serve the '{key}:previous' copy meanwhile, or poll for the new value
+CACHE_LEASE_TTL = int(os.environ.get('CACHE_LEASE_TTL', 900))
+CACHE_LEASE_POLL = float(os.environ.get('CACHE_LEASE_POLL', 0.5))
+# Longest a request polls for another process's rebuild before giving up on it
+CACHE_LEASE_WAIT = float(os.environ.get('CACHE_LEASE_WAIT', 5))
+CACHE_PREVIOUS_TTL = int(os.environ.get('CACHE_PREVIOUS_TTL', 3 * 86400))
+
+# Stale-while-revalidate: entries carry a soft expiry (refresh_at, set from refresh_after) next to memcached's hard
+# expiry. Past the soft expiry the entry is still served while one background thread rebuilds it
+# Every entry is written under a generation and nothing deletes old generations, so the hard expiry is what frees
+# them: two days keeps the current generation through one missed nightly run
+CACHE_HARD_TTL = int(os.environ.get('CACHE_HARD_TTL', 2 * 86400))
+
+# Cached entries live under a generation prefix, '{generation}:{name}'. run_data_jobs writes a complete new
+# generation and then flips CACHE_GENERATION_KEY to it in one set, so readers never see a half-written refresh
+CACHE_GENERATION_KEY = 'cache_generation'
+DEFAULT_GENERATION = '0'
+# Each process rereads the published generation at most every CACHE_GENERATION_CHECK seconds
+CACHE_GENERATION_CHECK = float(os.environ.get('CACHE_GENERATION_CHECK', 5))
+
+# JSON documents (precomputed figures) are stored as JSON_MAGIC + format version byte + zstd(UTF-8 JSON)
+JSON_MAGIC = b'ETFJ'
+
+# In-process tier in front of memcached: at most LOCAL_CACHE_SIZE frames per process, each kept LOCAL_CACHE_TTL seconds
+LOCAL_CACHE_SIZE = int(os.environ.get('LOCAL_CACHE_SIZE', 64))
+LOCAL_CACHE_TTL = float(os.environ.get('LOCAL_CACHE_TTL', 60))
+
+# NumPy kinds stored as raw buffers: bool, int, uint, float, complex, timedelta, datetime
+RAW_DTYPE_KINDS = 'biufcmM'
+
+def json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} values can not be cached.")
+
+# Describes one column (or the index) in the meta header and returns the bytes holding its values
+def encode_values(name, values):
+    if isinstance(values, pd.RangeIndex):
+        return {'name': name, 'kind': 'range', 'start': values.start, 'stop': values.stop, 'step': values.step}, b''
+    if isinstance(values.dtype, np.dtype) and values.dtype.kind in RAW_DTYPE_KINDS:
+        data = np.ascontiguousarray(values.to_numpy()).tobytes()
+        return {'name': name, 'kind': 'raw', 'dtype': values.dtype.str, 'nbytes': len(data)}, data
+    data = json.dumps(values.tolist(), default=json_value).encode()
+    return {'name': name, 'kind': 'json', 'nbytes': len(data)}, data
+
+def decode_values(spec, body, offset):
+    if spec['kind'] == 'range':
+        return pd.RangeIndex(spec['start'], spec['stop'], spec['step'], name=spec['name']), offset
+    end = offset + spec['nbytes']
+    if spec['kind'] == 'raw':
+        values = np.frombuffer(body, dtype=np.dtype(spec['dtype']), count=spec['nbytes'] // np.dtype(spec['dtype']).itemsize, offset=offset)
+    else:
+        items = json.loads(body[offset:end])
+        values = np.empty(len(items), dtype=object)
+        values[:] = items
+    return values, end
+
+def encode_frame(df, refresh_at=None):
+    specs, buffers = [], []
+    spec, data = encode_values(df.index.name, df.index)
+    specs.append(spec)
+    buffers.append(data)
+    for position in range(df.shape[1]):
+        spec, data = encode_values(df.columns[position], df.iloc[:, position])
+        specs.append(spec)
+        buffers.append(data)
+
+    meta = json.dumps({'index': specs[0], 'columns': specs[1:], 'refresh_at': refresh_at}, default=json_value).encode()
+    body = len(meta).to_bytes(4, 'big') + meta + b''.join(buffers)
+    return CACHE_MAGIC + bytes([CACHE_FORMAT_VERSION]) + zstandard.ZstdCompressor(level=CACHE_ZSTD_LEVEL).compress(body)
+
+# Returns (frame, refresh_at), or None for anything that is not a frame written by this version of the codec
+def decode_entry(payload):
+    header = CACHE_MAGIC + bytes([CACHE_FORMAT_VERSION])
+    if not isinstance(payload, bytes) or payload[:len(header)] != header:
+        return None
+    body = zstandard.ZstdDecompressor().decompress(payload[len(header):])
+    meta_length = int.from_bytes(body[:4], 'big')
+    meta = json.loads(body[4:4 + meta_length])
+
+    offset = 4 + meta_length
+    index, offset = decode_values(meta['index'], body, offset)
+    columns = {}
+    for position, spec in enumerate(meta['columns']):
+        columns[position], offset = decode_values(spec, body, offset)
+
+    # The DataFrame constructor copies the columns out of the read-only payload buffer
+    df = pd.DataFrame(columns, index=pd.Index(index, name=meta['index']['name']))
+    if meta['columns']:
+        df.columns = [spec['name'] for spec in meta['columns']]
+    return df, meta.get('refresh_at')
+
+def decode_frame(payload):
+    entry = decode_entry(payload)
+    return entry[0] if entry is not None else None
+
+# Generation set by building_generation for the current thread, takes precedence over the published one
+generation_override = threading.local()
+
+# Last published generation read by this process, and when it was read
+published_generation = (None, 0.0)
+
+def read_generation():
+    global published_generation
+    generation, read_at = published_generation
+    if generation is None or monotonic() - read_at >= CACHE_GENERATION_CHECK:
+        generation = mc.get(CACHE_GENERATION_KEY)
+        generation = generation if generation is not None else DEFAULT_GENERATION
+        published_generation = (generation, monotonic())
+    return generation
+
+# Resolved once per Flask request, so every entry read while serving it comes from the same generation
+def current_generation():
+    if getattr(generation_override, 'generation', None) is not None:
+        return generation_override.generation
+    if not has_request_context():
+        return read_generation()
+    if 'cache_generation' not in g:
+        g.cache_generation = read_generation()
+    return g.cache_generation
+
+def generation_key(name, generation=None):
+    return f"{generation if generation is not None else current_generation()}:{name}"
+
+def new_generation():
+    return datetime.now().strftime('%Y%m%d%H%M%S')
+
+def publish_generation(generation):
+    global published_generation
+    mc.set(CACHE_GENERATION_KEY, generation)
+    published_generation = (generation, monotonic())
+
+# Reads and writes in this thread go to generation until the block exits, so values derived from cached ones
+# (like figures) are built from the unpublished generation
+@contextmanager
+def building_generation(generation):
+    previous = getattr(generation_override, 'generation', None)
+    generation_override.generation = generation
+    try:
+        yield
+    finally:
+        generation_override.generation = previous
+
+def cache_get_frame(key):
+    return decode_frame(mc.get(key))
+
+# Also refreshes the longer lived previous-value copy served while the key is being rebuilt
+# Returns False when memcached did not store the value (e.g. it is over the item size limit)
+def cache_set_frame(key, df, time=0, refresh_after=None):
+    refresh_at = datetime.now().timestamp() + refresh_after if refresh_after is not None else None
+    payload = encode_frame(df, refresh_at)
+    # The payload is already compressed, skip bmemcached's zlib pass
+    stored = mc.set(key, payload, time=time, compress_level=0)
+    mc.set(f'{key}:previous', payload, time=CACHE_PREVIOUS_TTL, compress_level=0)
+    return bool(stored)
+
+# text is an already serialized JSON document, read back parsed into plain dicts and lists
+def cache_set_json(key, text, time=0):
+    payload = JSON_MAGIC + bytes([CACHE_FORMAT_VERSION]) + zstandard.ZstdCompressor(level=CACHE_ZSTD_LEVEL).compress(text.encode())
+    return bool(mc.set(key, payload, time=time, compress_level=0))
+
+def cache_get_json(key):
+    payload = mc.get(key)
+    header = JSON_MAGIC + bytes([CACHE_FORMAT_VERSION])
+    if not isinstance(payload, bytes) or payload[:len(header)] != header:
+        return None
+    return json.loads(zstandard.ZstdDecompressor().decompress(payload[len(header):]))
+
+def cache_acquire_lease(key):
+    return mc.add(f'{key}:lease', str(os.getpid()), time=CACHE_LEASE_TTL)
+
+def cache_release_lease(key):
+    mc.delete(f'{key}:lease')
+
+# Rebuilds key in a daemon thread unless another process already holds its lease
+# A failed or unstored refresh keeps the lease until it expires, so it is retried every CACHE_LEASE_TTL seconds
+def cache_refresh_in_background(key, build, time=0, refresh_after=None):
+    if not cache_acquire_lease(key):
+        return
+
+    def refresh():
+        try:
+            stored = cache_set_frame(key, build(), time, refresh_after)
+        except Exception:
+            logger.exception("Background refresh of %s failed", key)
+            return
+        if stored:
+            cache_release_lease(key)
+        else:
+            logger.error("Background refresh of %s was not stored, keeping its lease", key)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+# Returns the cached value for key without ever calling build in the caller's thread: a stale entry, or the
+# previous copy when the entry is gone, is returned while a background refresh runs. None if nothing is cached
+def cache_get_or_refresh(key, build, time=0, refresh_after=None):
+    entry = decode_entry(mc.get(key))
+    if entry is not None:
+        df, refresh_at = entry
+        if refresh_at is not None and datetime.now().timestamp() >= refresh_at:
+            cache_refresh_in_background(key, build, time, refresh_after)
+        return df
+
+    df = cache_get_frame(f'{key}:previous')
+    if df is not None:
+        cache_refresh_in_background(key, build, time, refresh_after)
+    return df
+
+# Single-flight cache fill: build only runs in the caller's thread when nothing is cached for key at all, and
+# then only in the process holding the lease. The others poll for the rebuilt value, taking over if the lease
+# is released or expires without one. A Dash callback stops polling after CACHE_LEASE_WAIT seconds and leaves
+# its outputs as they are (PreventUpdate), the next interaction tries again
+def cache_get_or_build(key, build, time=0, refresh_after=None):
+    deadline = monotonic() + CACHE_LEASE_WAIT
+    while True:
+        df = cache_get_or_refresh(key, build, time, refresh_after)
+        if df is not None:
+            return df
+
+        if cache_acquire_lease(key):
+            try:
+                df = build()
+                stored = cache_set_frame(key, df, time, refresh_after)
+            except Exception:
+                cache_release_lease(key)
+                raise
+            # A value memcached refuses keeps the lease, so waiters don't take the lease and rebuild it one after another
+            if stored:
+                cache_release_lease(key)
+            else:
+                logger.error("Cache rebuild of %s was not stored, keeping its lease", key)
+            return df
+
+        # The rebuild can take minutes, don't hold the request for the rest of the lease
+        if has_request_context() and monotonic() >= deadline:
+            raise PreventUpdate
+        sleep(CACHE_LEASE_POLL)
+
+
+# Size-bounded LRU of values that also expire ttl seconds after they were set
+class LocalCache:
+    def __init__(self, max_size=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if monotonic() >= expires:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+local_cache = LocalCache()
+cached_functions = []
+
+# Frame-returning function cached in the local tier, then memcached, under key_format filled in with its arguments
+# Keys are generation keys, so publishing a new generation also invalidates the local tier
+# Every call returns a copy, callers are free to modify the frame
+class CachedFunction:
+    def __init__(self, func, key_format, time=CACHE_HARD_TTL, refresh_after=None):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.key_format = key_format
+        self.time = time
+        self.refresh_after = refresh_after
+        self.stats = {'local_hits': 0, 'local_misses': 0, 'memcached_hits': 0, 'memcached_misses': 0}
+        self.stats_lock = threading.Lock()
+        cached_functions.append(self)
+
+    def count(self, tier, hit):
+        with self.stats_lock:
+            self.stats[f"{tier}_{'hits' if hit else 'misses'}"] += 1
+
+    def key(self, *args, generation=None):
+        return generation_key(self.key_format.format(*args), generation)
+
+    # Cached value from either tier, or None, never building it in the caller's thread
+    def peek(self, *args):
+        key = self.key(*args)
+        df = local_cache.get(key)
+        self.count('local', df is not None)
+        if df is None:
+            df = cache_get_or_refresh(key, lambda: self.func(*args), self.time, self.refresh_after)
+            self.count('memcached', df is not None)
+            if df is None:
+                return None
+            local_cache.set(key, df)
+        return df.copy()
+
+    def __call__(self, *args):
+        df = self.peek(*args)
+        if df is None:
+            key = self.key(*args)
+            df = cache_get_or_build(key, lambda: self.func(*args), self.time, self.refresh_after)
+            local_cache.set(key, df)
+            df = df.copy()
+        return df
+
+    # Writes an already computed value, to the current generation by default
+    def store(self, df, *args, generation=None):
+        key = self.key(*args, generation=generation)
+        cache_set_frame(key, df, self.time, self.refresh_after)
+        local_cache.set(key, df.copy())
+
+    # Recomputes and overwrites the cached value
+    def refresh(self, *args, generation=None):
+        self.store(self.func(*args), *args, generation=generation)
+
+def cached(key_format, time=CACHE_HARD_TTL, refresh_after=None):
+    def decorator(func):
+        return CachedFunction(func, key_format, time, refresh_after)
+    return decorator
+
+# Hit/miss counters per cached function and tier for this process
+def get_cache_stats():
+    return {function.__name__: dict(function.stats) for function in cached_functions}
@@ -1,94 +1,168 @@
 import yfinance as yf
 import pandas as pd
 import numpy as np
-from datetime import datetime
+import os
+import time
+import concurrent.futures
+from datetime import datetime, timedelta
 
-from load_data import load_etf_df, fetch_etf_data
-from utilities import TICKER_LIST
-from database import save_to_db
+from load_data import load_etf_df, load_etf_last_date, fetch_etf_data, fetch_etf_data_batch, ticker_prices
+from utilities import TICKER_LIST, warmup_start_date
+from database import save_etf_data
 
 #Pulls ETF data from RDS, fetches new data from Yahoo Finance, computes values, and pushes back to RDS
 #Scheduled to run every weekday at 6am
-def calculate_rolling_volatility(df, window=21, annualize=True):
-    returns = df['close'].pct_change().dropna()
-    rolling_volatility = returns.rolling(window=window).std()
-    if annualize:
-        rolling_volatility *= np.sqrt(252)
-    df['volatility'] = rolling_volatility*100
-    return df
 
-def calculate_dividend_yield(df):
-    df['div_yield'] = df['dividends'] / df['close']
-    df['div_yield'] = df['div_yield'].replace([np.inf, -np.inf], np.nan)
-    return df
+# Stored closes the indicators need before the first new row: 21 returns for volatility/Sharpe, 14 diffs for RSI
+INDICATOR_WARMUP_ROWS = 22
 
-def calculate_rsi(df, window=14):
-    delta = df['close'].diff()
-    gain = delta.where(delta > 0, 0)
-    loss = -delta.where(delta < 0, 0)
-    avg_gain = gain.rolling(window=window, min_periods=window).mean()
-    avg_loss = loss.rolling(window=window, min_periods=window).mean()
-    rs = avg_gain / avg_loss
-    rsi = 100 - (100 / (1 + rs))
-    df['rsi'] = rsi
-    return df
+# Nightly update concurrency: tickers processed at once, attempts per ticker and the first retry delay in seconds
+UPDATE_MAX_WORKERS = int(os.environ.get('UPDATE_MAX_WORKERS', 4))
+UPDATE_ATTEMPTS = int(os.environ.get('UPDATE_ATTEMPTS', 3))
+UPDATE_BACKOFF = float(os.environ.get('UPDATE_BACKOFF', 2.0))
 
-def calculate_sharpe_ratio(df, window=21, risk_free_rate=0.01):
-    returns = df['close'].pct_change().dropna()
-    rolling_avg_return = returns.rolling(window=window).mean()
-    rolling_std_dev = returns.rolling(window=window).std()
-    sharpe_ratio = (rolling_avg_return - risk_free_rate) / rolling_std_dev
-    df['sharpe'] = sharpe_ratio
-    return df
+# Computes every indicator for all tickers in one vectorized pass over date x ticker close and dividend matrices
+# Returns a frame with (metric, ticker) columns
+def compute_indicators(close, dividends, vol_window=21, rsi_window=14, sharpe_window=21, risk_free_rate=0.01):
+    # Returns are computed once and shared by volatility and Sharpe
+    returns = close.pct_change()
+    rolling_std = returns.rolling(window=vol_window).std()
+    volatility = rolling_std * np.sqrt(252) * 100
+    if sharpe_window == vol_window:
+        sharpe_std = rolling_std
+    else:
+        sharpe_std = returns.rolling(window=sharpe_window).std()
+    sharpe = (returns.rolling(window=sharpe_window).mean() - risk_free_rate) / sharpe_std
+
+    div_yield = (dividends / close).replace([np.inf, -np.inf], np.nan)
 
-def calculate_pct_change(df):
-    df['ytd_pct'] = np.nan
-    end_of_year_prices = df.resample('Y').last()['close']
-    for year in end_of_year_prices.index.year[:-1]:
-        end_price_prev_year = end_of_year_prices[end_of_year_prices.index.year == year].values[0]
-        mask = (df.index.year == year + 1)
-        df.loc[mask, 'ytd_pct'] = (df.loc[mask, 'close'] / end_price_prev_year - 1) * 100
+    delta = close.diff()
+    avg_gain = delta.where(delta > 0, 0).rolling(window=rsi_window, min_periods=rsi_window).mean()
+    avg_loss = (-delta.where(delta < 0, 0)).rolling(window=rsi_window, min_periods=rsi_window).mean()
+    rsi = 100 - (100 / (1 + avg_gain / avg_loss))
+    # A ticker's RSI starts rsi_window rows after its own first row, not after the first row of the matrix
+    rows_seen = (close.notna() | dividends.notna()).cumsum()
+    rsi = rsi.where(rows_seen >= rsi_window)
+
+    # YTD %: each row indexed to the previous year's last close
+    years = close.index.year
+    year_end = close.groupby(years).last().reindex(range(years.min(), years.max() + 1))
+    prior_year_end = year_end.shift(1).reindex(years)
+    ytd_pct = (close / prior_year_end.values - 1) * 100
+
+    return pd.concat({
+        'close': close,
+        'dividends': dividends,
+        'volatility': volatility,
+        'div_yield': div_yield,
+        'rsi': rsi,
+        'sharpe': sharpe,
+        'ytd_pct': ytd_pct,
+    }, axis=1)
+
+# One ticker's rows from a compute_indicators result, with the dates it has data for
+def ticker_indicators(indicators, ticker):
+    df = indicators.xs(ticker, axis=1, level=1)
+    return df[df[['close', 'dividends']].notna().any(axis=1)]
+
+# Indicators for a single-ticker close/dividends frame, other columns of df are kept
+def calculate_indicators(df):
+    indicators = ticker_indicators(compute_indicators(df[['close']], df[['dividends']].set_axis(['close'], axis=1)), 'close')
+    df = df.copy()
+    for column in ['volatility', 'div_yield', 'rsi', 'sharpe', 'ytd_pct']:
+        df[column] = indicators[column]
     return df
 
 def create_sector_dataframe(ticker, start_date):
     ticker = '^GSPC' if ticker == 'S&P 500' else ticker
     df = fetch_etf_data(ticker, start_date)
-    df = calculate_rolling_volatility(df)
-    df = calculate_dividend_yield(df)
-    df = calculate_rsi(df)
-    df = calculate_sharpe_ratio(df)
-    df = calculate_pct_change(df)
-    return df
+    return calculate_indicators(df)
 
-def update_sector_dataframe(ticker):
+# Loads only the stored state the indicators need for rows after the last stored date:
+# the trailing INDICATOR_WARMUP_ROWS closes and the close the YTD % is indexed to
+def load_indicator_state(ticker):
+    last_date = load_etf_last_date(ticker)
+    df = load_etf_df('all', [ticker], start_date=warmup_start_date(last_date, INDICATOR_WARMUP_ROWS), columns=['close'])
+
+    # Prepend the previous year-end close so the YTD % can be indexed for every year in the window
+    year_start = datetime(df.index[0].year, 1, 1)
+    prior_year = load_etf_df('all', [ticker], start_date=year_start - timedelta(days=31), end_date=year_start - timedelta(days=1), columns=['close'])
+    prior_year_end = prior_year.dropna().tail(1)
+    return pd.concat([prior_year_end, df]), last_date
+
+# incremental=True computes the new rows from the trailing indicator state instead of the full stored history
+# prices: optional fetch_etf_data_batch frame covering the ticker's new rows, to avoid a separate download
+def update_sector_dataframe(ticker, incremental=True, prices=None):
     if(ticker == 'S&P 500'):
         ticker = 'SP500'
 
-    df = load_etf_df('all', [ticker])
-    
-    start_date = df.index[-1]
-    new_df = fetch_etf_data(ticker, start_date)
-
-    if(new_df.index[-1] in new_df.index):
-        new_df = new_df.iloc[1:]
+    if incremental:
+        df, start_date = load_indicator_state(ticker)
+    else:
+        df = load_etf_df('all', [ticker])
+        start_date = df.index[-1]
+    if prices is None:
+        new_df = fetch_etf_data(ticker, start_date)
+    else:
+        new_df = ticker_prices(prices, ticker)
+    # Every fetch starts at or before the last stored date, so no rows at all means the download failed:
+    # yf.download leaves a failed ticker's columns empty instead of raising
+    if new_df.empty:
+        raise ValueError(f"No prices returned for {ticker} since {start_date:%Y-%m-%d}.")
+    new_df = new_df[new_df.index > start_date]
     
     df = pd.concat([df, new_df])
-    df = calculate_rolling_volatility(df)
-    df = calculate_dividend_yield(df)
-    df = calculate_rsi(df)
-    df = calculate_sharpe_ratio(df)
-    df = calculate_pct_change(df)
+    df = calculate_indicators(df)
     df.drop(columns = 'dividends', inplace = True)
     
     return df[df.index > start_date]
 
-def update_sector_data():
-    for ticker in TICKER_LIST:
-        df = update_sector_dataframe(ticker)
-        ticker = 'sp500' if ticker == 'S&P 500' else ticker
-        save_to_db(df, ticker)
+# Read, compute and write one ticker, retrying with exponential backoff
+# Returns a summary row; a failure is recorded instead of raised so other tickers are unaffected
+def update_ticker(ticker, prices=None, attempts=UPDATE_ATTEMPTS, backoff=UPDATE_BACKOFF):
+    start = time.perf_counter()
+    error = None
+    for attempt in range(1, attempts + 1):
+        try:
+            # Retries fetch the ticker on its own in case the shared batch was what failed
+            df = update_sector_dataframe(ticker, prices=prices if attempt == 1 else None)
+            save_etf_data(df, ticker)
+            return {'ticker': ticker, 'status': 'ok', 'rows': len(df), 'attempts': attempt,
+                    'seconds': time.perf_counter() - start, 'error': None}
+        except Exception as e:
+            error = e
+            if attempt < attempts:
+                time.sleep(backoff * 2 ** (attempt - 1))
+    return {'ticker': ticker, 'status': 'failed', 'rows': 0, 'attempts': attempts,
+            'seconds': time.perf_counter() - start, 'error': repr(error)}
+
+def safe_last_date(ticker):
+    try:
+        return load_etf_last_date(ticker)
+    except Exception:
+        return None
+
+# Updates every ticker with up to max_workers tickers in flight, so DB reads/writes and downloads overlap
+# Returns one summary row per ticker with its status, rows written, attempts and duration
+def update_sector_data(max_workers=UPDATE_MAX_WORKERS, attempts=UPDATE_ATTEMPTS, backoff=UPDATE_BACKOFF):
+    tickers = ['SP500' if ticker == 'S&P 500' else ticker for ticker in TICKER_LIST]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        last_dates = list(executor.map(safe_last_date, tickers))
+
+        # One download from the oldest last stored date covers every ticker, workers fall back to single fetches
+        prices = None
+        known_dates = [last_date for last_date in last_dates if last_date is not None]
+        if known_dates:
+            try:
+                prices = fetch_etf_data_batch(tickers, min(known_dates))
+            except Exception:
+                prices = None
+
+        futures = [executor.submit(update_ticker, ticker, prices, attempts, backoff) for ticker in tickers]
+        return [future.result() for future in futures]
 
 
 if __name__ == '__main__':
-    update_sector_data()
+    print(pd.DataFrame(update_sector_data()).to_string(index=False))
     
\ No newline at end of file
@@ -1,12 +1,64 @@
 import psycopg2
+import psycopg2.pool
+import numpy as np
 import pandas as pd
+import io
 import os
+import threading
+import sys
+import time
+from contextlib import contextmanager
+
+from utilities import TICKER_LIST
 
 my_db_host = os.environ.get('MY_DB_HOST')
 my_db_name = os.environ.get('MY_DB_NAME')
 my_db_user = os.environ.get('MY_DB_USER')
 my_db_pass = os.environ.get('MY_DB_PASS')
 
+# Per-process connection pool settings
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 4))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', 60))
+
+DTYPE_TO_SQL = {'object': 'TEXT', 'int64': 'INTEGER', 'float64': 'REAL'}
+
+# ETF storage mode: 'tables' keeps one table per ticker, 'long' keeps every ticker in the ETF_TABLE fact table
+ETF_STORAGE = os.environ.get('ETF_STORAGE', 'tables')
+ETF_TABLE = 'etf_data'
+ETF_PARTITION_BY_YEAR = os.environ.get('ETF_PARTITION_BY_YEAR', 'false').lower() == 'true'
+ETF_COLUMNS = ['close', 'dividends', 'volatility', 'div_yield', 'rsi', 'sharpe', 'ytd_pct']
+
+# Fixed-width column types understood by read_binary_columns, as big-endian NumPy dtypes
+BINARY_COPY_TYPES = {'int4': '>i4', 'float8': '>f8', 'timestamp': '>i8'}
+# Binary timestamps are microseconds since the Postgres epoch
+POSTGRES_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+
+# Local copy of the FRED observations used by the macro card, one row per (series_id, date)
+FRED_TABLE = 'fred_observations'
+
+# S&P 500 watchlist, one row per ticker. Each field group is refreshed on its own schedule and
+# records when it was last fetched in {group}_updated_at
+WATCHLIST_TABLE = 'watchlist'
+WATCHLIST_FIELD_GROUPS = {
+    'identity': ['name', 'sector'],
+    'fundamentals': ['market_cap', 'pe_ratio', 'earnings_growth', 'eps', 'peg_ratio', 'beta'],
+    'prices': ['price', 'change_1m', 'change_6m', 'avg_200d'],
+}
+# Yahoo sector name -> name shown in the watchlist, kept in the generated display_sector column.
+# Sectors mapped to None are left out of the watchlist
+WATCHLIST_SECTOR_NAMES = {
+    'Financial Services': 'Financials',
+    'Basic Materials': 'Materials',
+    'Consumer Cyclical': 'Cons. Cyclical',
+    'Communication Services': 'Communications',
+    'Consumer Defensive': 'Cons. Defensive',
+    'Unknown': None,
+}
+
+# S&P 500 membership history, one row per (ticker, added) spell. removed is NULL while the ticker is in the index
+CONSTITUENTS_TABLE = 'sp500_constituents'
+
 
 def get_db_connection():
     conn = psycopg2.connect(
@@ -17,16 +69,144 @@ def get_db_connection():
     )
     return conn
 
-def save_to_db(df, table_name):
-    conn = get_db_connection()
-    cur = conn.cursor()
 
-    # Ensure the DataFrame's index is datetime
-    if not pd.api.types.is_datetime64_any_dtype(df.index):
-        raise ValueError("The DataFrame index must be a datetime object.")
-    
+# Bounded, thread-safe pool of open connections owned by a single process
+# Idle connections are pinged before reuse once they have been idle for DB_POOL_PING_AFTER seconds
+class ConnectionPool:
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, ping_after=DB_POOL_PING_AFTER):
+        self.size = size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.pid = os.getpid()
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        self.stats = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'connections_opened': 0,
+            'connections_discarded': 0,
+            'in_use': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'hold_seconds_total': 0.0,
+            'hold_seconds_max': 0.0,
+        }
+
+    def is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def discard(self, conn):
+        with self.lock:
+            self.stats['connections_discarded'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        start = time.perf_counter()
+        if not self.slots.acquire(timeout=self.timeout):
+            with self.lock:
+                self.stats['timeouts'] += 1
+            raise psycopg2.pool.PoolError(f"Timed out after {self.timeout}s waiting for a database connection.")
+        try:
+            conn = None
+            while conn is None:
+                with self.lock:
+                    conn, idle_since = self.idle.pop() if self.idle else (None, None)
+                if conn is None:
+                    conn = get_db_connection()
+                    with self.lock:
+                        self.stats['connections_opened'] += 1
+                elif not self.is_healthy(conn, idle_since):
+                    self.discard(conn)
+                    conn = None
+        except Exception:
+            self.slots.release()
+            raise
+
+        wait = time.perf_counter() - start
+        with self.lock:
+            self.stats['checkouts'] += 1
+            self.stats['in_use'] += 1
+            self.stats['wait_seconds_total'] += wait
+            self.stats['wait_seconds_max'] = max(self.stats['wait_seconds_max'], wait)
+        return conn
+
+    def putconn(self, conn, hold=0.0):
+        with self.lock:
+            self.stats['in_use'] -= 1
+            self.stats['hold_seconds_total'] += hold
+            self.stats['hold_seconds_max'] = max(self.stats['hold_seconds_max'], hold)
+        if conn.closed or conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            self.discard(conn)
+        else:
+            with self.lock:
+                self.idle.append((conn, time.monotonic()))
+        self.slots.release()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['idle'] = len(self.idle)
+        stats['size'] = self.size
+        checkouts = max(stats['checkouts'], 1)
+        stats['wait_seconds_avg'] = stats['wait_seconds_total'] / checkouts
+        stats['hold_seconds_avg'] = stats['hold_seconds_total'] / checkouts
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# Pools inherited through fork (gunicorn workers) are kept referenced but never used or closed,
+# so the child does not tear down connections that still belong to the parent
+_inherited_pools = []
+
+def get_pool():
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                if _pool is not None:
+                    _inherited_pools.append(_pool)
+                _pool = ConnectionPool()
+    return _pool
+
+def get_pool_stats():
+    return get_pool().get_stats()
+
+# Checks a connection out of this process's pool, commits on success and rolls back on error
+@contextmanager
+def db_connection():
+    pool = get_pool()
+    conn = pool.getconn()
+    checked_out = time.perf_counter()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        raise
+    finally:
+        pool.putconn(conn, time.perf_counter() - checked_out)
+
+def create_table_if_missing(cur, df, table_name):
     # Check if the table exists
-    table_name = table_name.lower()
     cur.execute(f"""
         SELECT EXISTS (
             SELECT FROM information_schema.tables 
@@ -40,25 +220,304 @@ def save_to_db(df, table_name):
         create_table_query = f"""
         CREATE TABLE {table_name} (
             datetime_index TIMESTAMP PRIMARY KEY,
-            {', '.join([f"{col} {dtype}" for col, dtype in zip(df.columns, df.dtypes.replace({'object': 'TEXT', 'int64': 'INTEGER', 'float64': 'REAL'}))])}
+            {', '.join([f"{col} {dtype}" for col, dtype in zip(df.columns, df.dtypes.astype(str).replace(DTYPE_TO_SQL))])}
         );
         """
         cur.execute(create_table_query)
+
+# Streams df into a temporary staging table with COPY, then merges it into table_name in one statement
+# on_conflict='skip' keeps existing rows, on_conflict='update' overwrites them with the new values
+def copy_upsert(cur, df, table_name, key_columns, on_conflict='skip'):
+    if on_conflict not in ('skip', 'update'):
+        raise ValueError("on_conflict must be 'skip' or 'update'.")
+
+    columns = list(df.columns)
+    staging_table = f"{table_name}_staging"
+    cur.execute(f"""
+        CREATE TEMP TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP;
+    """)
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=False, index=False, date_format='%Y-%m-%d %H:%M:%S')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {staging_table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    update_columns = [col for col in columns if col not in key_columns]
+    if on_conflict == 'update' and update_columns:
+        conflict_action = f"DO UPDATE SET {', '.join([f'{col} = EXCLUDED.{col}' for col in update_columns])}"
+    else:
+        conflict_action = "DO NOTHING"
+
+    cur.execute(f"""
+        INSERT INTO {table_name} ({', '.join(columns)})
+        SELECT {', '.join(columns)} FROM {staging_table}
+        ON CONFLICT ({', '.join(key_columns)}) {conflict_action};
+    """)
+    cur.execute(f"DROP TABLE {staging_table};")
+
+# method='copy' writes the whole DataFrame in one COPY + merge, method='rows' is the original row-by-row insert
+def save_to_db(df, table_name, method='copy', on_conflict='skip'):
+    # Ensure the DataFrame's index is datetime
+    if not pd.api.types.is_datetime64_any_dtype(df.index):
+        raise ValueError("The DataFrame index must be a datetime object.")
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        table_name = table_name.lower()
+        create_table_if_missing(cur, df, table_name)
         conn.commit()
 
-    # Insert the data into the table with conflict handling
-    for i, row in df.iterrows():
-        insert_query = f"""
-        INSERT INTO {table_name} (datetime_index, {', '.join(df.columns)})
-        VALUES (%s, {', '.join(['%s'] * len(row))})
-        ON CONFLICT (datetime_index) DO NOTHING;  -- Prevent duplicates
-        """
-        cur.execute(insert_query, (i,) + tuple(row))
+        if method == 'copy':
+            # A key can only be merged once per statement, keep the row each conflict mode would end up with
+            keep = 'last' if on_conflict == 'update' else 'first'
+            df = df[~df.index.duplicated(keep=keep)]
+            copy_upsert(cur, df.rename_axis('datetime_index').reset_index(), table_name, ['datetime_index'], on_conflict)
+        else:
+            # Insert the data into the table with conflict handling
+            for i, row in df.iterrows():
+                insert_query = f"""
+                INSERT INTO {table_name} (datetime_index, {', '.join(df.columns)})
+                VALUES (%s, {', '.join(['%s'] * len(row))})
+                ON CONFLICT (datetime_index) DO NOTHING;  -- Prevent duplicates
+                """
+                cur.execute(insert_query, (i,) + tuple(row))
+
+        cur.close()
+
+
+def get_table_columns(cur, table_name):
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s
+        ORDER BY ordinal_position;
+    """, (table_name,))
+    return [row[0] for row in cur.fetchall()]
 
-    conn.commit()
+# Runs query through COPY ... TO STDOUT (FORMAT binary) and decodes the rows straight into NumPy arrays,
+# one per entry of column_types. Every column must be fixed width and non-null, so the query should cast
+# float columns with COALESCE(col::text::float8, 'NaN') and must not end with a semicolon
+def read_binary_columns(conn, query, params, column_types):
+    cur = conn.cursor()
+    copy_query = cur.mogrify(query, params).decode()
+    buffer = io.BytesIO()
+    cur.copy_expert(f"COPY ({copy_query}) TO STDOUT (FORMAT binary)", buffer)
     cur.close()
-    conn.close()
+    data = buffer.getvalue()
+
+    # Header: 11 byte signature, 4 byte flags, 4 byte extension length, then the extension area
+    offset = 19 + int.from_bytes(data[15:19], 'big')
+    fields = [('field_count', '>i2')]
+    for i, column_type in enumerate(column_types):
+        fields += [(f'length_{i}', '>i4'), (f'value_{i}', BINARY_COPY_TYPES[column_type])]
+    row_dtype = np.dtype(fields)
+    # Each tuple is fixed width, the file ends with a 2 byte trailer. A NULL shortens its tuple, so the tuples
+    # no longer fill the body exactly
+    row_count, remainder = divmod(len(data) - offset - 2, row_dtype.itemsize)
+    if remainder:
+        raise ValueError("The binary result contains NULLs or columns of another type.")
+    rows = np.frombuffer(data, dtype=row_dtype, count=row_count, offset=offset)
+
+    columns = []
+    for i, column_type in enumerate(column_types):
+        value_dtype = np.dtype(BINARY_COPY_TYPES[column_type])
+        if (rows[f'length_{i}'] != value_dtype.itemsize).any():
+            raise ValueError(f"Column {i} of the binary result contains NULLs or is not {column_type}.")
+        values = rows[f'value_{i}'].astype(value_dtype.newbyteorder('='))
+        if column_type == 'timestamp':
+            values = (POSTGRES_EPOCH + values.astype('timedelta64[us]')).astype('datetime64[ns]')
+        columns.append(values)
+    return columns
+
+# Per-ticker table name, also used as the ticker key in ETF_TABLE
+def ticker_key(ticker):
+    return 'sp500' if ticker in ('S&P 500', 'SP500') else ticker.lower()
+
+# Creates the long-format ETF table, optionally range partitioned by year on datetime_index
+def create_etf_table(cur, partition_by_year=ETF_PARTITION_BY_YEAR):
+    partition = " PARTITION BY RANGE (datetime_index)" if partition_by_year else ""
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ETF_TABLE} (
+            ticker TEXT NOT NULL,
+            datetime_index TIMESTAMP NOT NULL,
+            {', '.join([f"{col} REAL" for col in ETF_COLUMNS])},
+            PRIMARY KEY (ticker, datetime_index)
+        ){partition};
+    """)
+
+def create_etf_partitions(cur, years):
+    cur.execute(f"""
+        SELECT EXISTS (
+            SELECT FROM pg_partitioned_table
+            WHERE partrelid = '{ETF_TABLE}'::regclass
+        );
+    """)
+    if not cur.fetchone()[0]:
+        return
+    for year in sorted(set(years)):
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ETF_TABLE}_{year} PARTITION OF {ETF_TABLE}
+            FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01');
+        """)
+
+# Writes one ticker's rows to the configured ETF storage
+def save_etf_data(df, ticker, on_conflict='skip'):
+    if ETF_STORAGE != 'long':
+        save_to_db(df, ticker_key(ticker), on_conflict=on_conflict)
+        return
+
+    if not pd.api.types.is_datetime64_any_dtype(df.index):
+        raise ValueError("The DataFrame index must be a datetime object.")
+
+    keep = 'last' if on_conflict == 'update' else 'first'
+    df = df[~df.index.duplicated(keep=keep)]
+    long_df = df[[col for col in ETF_COLUMNS if col in df.columns]].rename_axis('datetime_index').reset_index()
+    long_df.insert(0, 'ticker', ticker_key(ticker))
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        create_etf_table(cur)
+        create_etf_partitions(cur, df.index.year)
+        copy_upsert(cur, long_df, ETF_TABLE, ['ticker', 'datetime_index'], on_conflict)
+        cur.close()
+
+# Copies the per-ticker tables into ETF_TABLE server side, existing rows in ETF_TABLE are kept
+def migrate_ticker_tables(tickers, partition_by_year=ETF_PARTITION_BY_YEAR):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        create_etf_table(cur, partition_by_year)
+        for ticker in tickers:
+            table_name = ticker_key(ticker)
+            table_columns = get_table_columns(cur, table_name)
+            if not table_columns:
+                continue
+            columns = [col for col in ETF_COLUMNS if col in table_columns]
+
+            cur.execute(f"SELECT DISTINCT EXTRACT(YEAR FROM datetime_index)::int FROM {table_name};")
+            create_etf_partitions(cur, [row[0] for row in cur.fetchall()])
+
+            cur.execute(f"""
+                INSERT INTO {ETF_TABLE} (ticker, datetime_index, {', '.join(columns)})
+                SELECT %s, datetime_index, {', '.join(columns)} FROM {table_name}
+                ON CONFLICT (ticker, datetime_index) DO NOTHING;
+            """, (table_name,))
+        cur.execute(f"ANALYZE {ETF_TABLE};")
+        cur.close()
+
+
+def create_fred_table(cur):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {FRED_TABLE} (
+            series_id TEXT NOT NULL,
+            date DATE NOT NULL,
+            value DOUBLE PRECISION,
+            PRIMARY KEY (series_id, date)
+        );
+    """)
+
+# Appends FRED observations given as a series ID -> Series dict, revised values overwrite stored ones
+def save_fred_observations(series):
+    frames = [pd.DataFrame({'series_id': series_id, 'date': values.index, 'value': values.values})
+              for series_id, values in series.items() if len(values) > 0]
+    if not frames:
+        return
+    df = pd.concat(frames, ignore_index=True)
+    df['date'] = pd.to_datetime(df['date'])
+    df = df[~df.duplicated(['series_id', 'date'], keep='last')]
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        create_fred_table(cur)
+        copy_upsert(cur, df, FRED_TABLE, ['series_id', 'date'], on_conflict='update')
+        cur.close()
+
+watchlist_table_ready = False
+
+def create_watchlist_table(cur):
+    global watchlist_table_ready
+    columns = [f"{col} TEXT" for col in WATCHLIST_FIELD_GROUPS['identity']]
+    columns += [f"{col} DOUBLE PRECISION" for group in ['fundamentals', 'prices'] for col in WATCHLIST_FIELD_GROUPS[group]]
+    columns += [f"{group}_updated_at TIMESTAMP" for group in WATCHLIST_FIELD_GROUPS]
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {WATCHLIST_TABLE} (
+            ticker TEXT PRIMARY KEY,
+            {', '.join(columns)}
+        );
+    """)
+    # Checked first, ALTER TABLE locks the table even when the column already exists
+    if 'display_sector' not in get_table_columns(cur, WATCHLIST_TABLE):
+        cur.execute(f"ALTER TABLE {WATCHLIST_TABLE} ADD COLUMN IF NOT EXISTS display_sector TEXT GENERATED ALWAYS AS ({display_sector_sql()}) STORED;")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {WATCHLIST_TABLE}_display_sector_idx ON {WATCHLIST_TABLE} (display_sector);")
+    watchlist_table_ready = True
+
+# For the read path, runs create_watchlist_table only until it has succeeded once in this process
+def ensure_watchlist_table(cur):
+    if not watchlist_table_ready:
+        create_watchlist_table(cur)
+
+def display_sector_sql():
+    cases = []
+    for sector, name in WATCHLIST_SECTOR_NAMES.items():
+        cases.append(f"WHEN '{sector}' THEN " + (f"'{name}'" if name is not None else "NULL"))
+    return f"CASE sector {' '.join(cases)} ELSE sector END"
+
+# Upserts the columns present in df (ticker plus any field groups), leaving the other columns of existing rows as they are
+def save_watchlist_rows(df):
+    if df.empty:
+        return
+    with db_connection() as conn:
+        cur = conn.cursor()
+        create_watchlist_table(cur)
+        copy_upsert(cur, df, WATCHLIST_TABLE, ['ticker'], on_conflict='update')
+        cur.close()
+
+# Drops the rows of tickers that are no longer in the index
+def delete_watchlist_rows_except(tickers):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        create_watchlist_table(cur)
+        cur.execute(f"DELETE FROM {WATCHLIST_TABLE} WHERE NOT (ticker = ANY(%s));", (list(tickers),))
+        cur.close()
+
+def create_constituents_table(cur):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CONSTITUENTS_TABLE} (
+            ticker TEXT NOT NULL,
+            added DATE NOT NULL,
+            removed DATE,
+            PRIMARY KEY (ticker, added)
+        );
+    """)
+
+def load_constituents():
+    with db_connection() as conn:
+        cur = conn.cursor()
+        create_constituents_table(cur)
+        cur.execute(f"SELECT ticker FROM {CONSTITUENTS_TABLE} WHERE removed IS NULL ORDER BY ticker;")
+        tickers = [row[0] for row in cur.fetchall()]
+        cur.close()
+    return tickers
+
+# Diffs tickers against the current constituents, opening a spell for each new ticker and closing the spells of
+# tickers that left the index, effective as_of. Returns the (added, removed) ticker lists
+def record_constituent_changes(tickers, as_of=None):
+    as_of = as_of or pd.Timestamp.today().date()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        create_constituents_table(cur)
+        # Serializes concurrent diffs, so a ticker can not get two open spells
+        cur.execute(f"LOCK TABLE {CONSTITUENTS_TABLE} IN SHARE ROW EXCLUSIVE MODE;")
+        cur.execute(f"SELECT ticker FROM {CONSTITUENTS_TABLE} WHERE removed IS NULL;")
+        current = {row[0] for row in cur.fetchall()}
+        added = sorted(set(tickers) - current)
+        removed = sorted(current - set(tickers))
 
+        if added:
+            cur.executemany(f"INSERT INTO {CONSTITUENTS_TABLE} (ticker, added) VALUES (%s, %s) ON CONFLICT (ticker, added) DO UPDATE SET removed = NULL;",
+                            [(ticker, as_of) for ticker in added])
+        cur.execute(f"UPDATE {CONSTITUENTS_TABLE} SET removed = %s WHERE removed IS NULL AND ticker = ANY(%s);", (as_of, removed))
+        cur.close()
+    return added, removed
 
 def ticker_csv_to_database():
     tickers = ['XLC', 'XLF','XLI', 'XLK','XLP','XLRE','XLU','XLV','XLY', 'S&P 500']
@@ -70,4 +529,7 @@ def ticker_csv_to_database():
         save_to_db(df, ticker_name)
 
 if __name__ == '__main__':
-    ticker_csv_to_database()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        migrate_ticker_tables(TICKER_LIST)
+    else:
+        ticker_csv_to_database()
@@ -2,67 +2,233 @@ import yfinance as yf
 import pandas as pd
 import numpy as np
 from fredapi import Fred
-from datetime import datetime
+from datetime import datetime, timedelta
 import concurrent.futures
-import io
 import os
+import threading
+import time
+import zlib
 from urllib.parse import urlparse
-import bmemcached
 
-from database import get_db_connection
+from cache import cached, cache_acquire_lease, cache_release_lease, generation_key, LocalCache
+from database import db_connection, read_binary_columns, get_table_columns, ticker_key, create_fred_table, save_fred_observations, create_watchlist_table, ensure_watchlist_table, save_watchlist_rows, delete_watchlist_rows_except, load_constituents, record_constituent_changes, ETF_STORAGE, ETF_TABLE, ETF_COLUMNS, FRED_TABLE, WATCHLIST_TABLE, WATCHLIST_FIELD_GROUPS
 from utilities import MACRO_TRACE_DICT, calculate_yoy, ETF_TO_SECTOR, TICKER_LIST
 
 FRED_API_KEY = os.environ.get('FRED_API_KEY')
 fred = Fred(api_key=FRED_API_KEY)
 
-mc = bmemcached.Client(os.environ.get('MEMCACHEDCLOUD_SERVERS').split(','), os.environ.get('MEMCACHEDCLOUD_USERNAME'), os.environ.get('MEMCACHEDCLOUD_PASSWORD'))
 
+# Source of ETF prices: 'yahoo' downloads from Yahoo Finance, 'fake' generates deterministic prices offline
+PRICE_PROVIDER = os.environ.get('PRICE_PROVIDER', 'yahoo')
+
+
+# Yahoo writes share classes with '-' where Wikipedia uses '.' (BRK.B -> BRK-B)
+def yahoo_symbol(ticker):
+    return '^GSPC' if ticker == 'S&P 500' or ticker == 'SP500' else ticker.replace('.', '-')
+
+# yf.download collects results in module-level state, so concurrent batch downloads must not overlap
+yahoo_download_lock = threading.Lock()
+
+# Price providers take a list of symbols and return Yahoo-style history with ('Close'/'Dividends', symbol) columns
+def download_yahoo_prices(symbols, start_date, interval='1d'):
+    if len(symbols) == 1:
+        df = yf.Ticker(symbols[0]).history(start=start_date, interval=interval)
+        df.columns = pd.MultiIndex.from_product([df.columns, symbols])
+        return df
+    with yahoo_download_lock:
+        return yf.download(symbols, start=start_date, interval=interval, actions=True, auto_adjust=True, progress=False)
+
+# Offline provider: a random walk per symbol from a fixed origin, with a dividend on the last business day of each quarter
+def fake_prices(symbols, start_date, interval='1d'):
+    index = pd.bdate_range(start='2000-01-03', end=datetime.now().date())
+    quarter_end = pd.Series(index, index=index).groupby(index.to_period('Q')).transform('max') == index
+    close, dividends = {}, {}
+    for symbol in symbols:
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+        close[symbol] = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.01, len(index))))
+        dividends[symbol] = np.where(quarter_end, close[symbol] * 0.004, 0.0)
+    df = pd.concat({'Close': pd.DataFrame(close, index=index), 'Dividends': pd.DataFrame(dividends, index=index)}, axis=1)
+    return df[df.index >= pd.Timestamp(start_date)]
+
+PRICE_PROVIDERS = {'yahoo': download_yahoo_prices, 'fake': fake_prices}
+
+# Close and dividends for several tickers from a single provider call
+# Returns a wide frame with ('close'/'dividends', ticker) columns, keyed by the tickers as passed in
+def fetch_etf_data_batch(tickers, start_date='2022-12-1', interval='1d', provider=None):
+    provider = provider or PRICE_PROVIDERS[PRICE_PROVIDER]
+    symbols = [yahoo_symbol(ticker) for ticker in tickers]
+    raw = provider(list(dict.fromkeys(symbols)), start_date, interval)
+
+    close = raw['Close'].reindex(columns=symbols).set_axis(tickers, axis=1)
+    dividends = raw['Dividends'].reindex(columns=symbols).set_axis(tickers, axis=1)
+    df = pd.concat({'close': close, 'dividends': dividends}, axis=1)
+    df.index = pd.to_datetime(df.index.date)
+    return df
+
+# One ticker's close/dividends rows out of a fetch_etf_data_batch frame
+def ticker_prices(prices, ticker):
+    df = prices.xs(ticker, axis=1, level=1)
+    return df[df.notna().any(axis=1)]
 
 def fetch_etf_data(ticker, start_date='2022-12-1', interval='1d'):
-    ticker = '^GSPC' if ticker == 'S&P 500' or ticker == 'SP500' else ticker
-    stock = yf.Ticker(ticker)
-    df = stock.history(start=start_date, interval=interval)
-    df.index = df.index.date
-    df.index = pd.to_datetime(df.index)
-    df.rename(columns = {'Close': 'close', 'Dividends':'dividends'}, inplace = True)
-    return df[['close', 'dividends']]
+    return ticker_prices(fetch_etf_data_batch([ticker], start_date, interval), ticker)
 
 # Card 1: Sector Data
-def load_etf_df(column_name, tickers=TICKER_LIST):
-    tickers = ['sp500' if ticker == 'S&P 500' else ticker for ticker in tickers]
+# Builds the datetime_index range condition pushed down into the SQL WHERE clause
+def date_range_filter(column, start_date=None, end_date=None):
+    conditions, params = [], []
+    if start_date is not None:
+        conditions.append(f"{column} >= %s")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append(f"{column} <= %s")
+        params.append(end_date)
+    return conditions, params
+
+# Non-null float8 projection of a metric column, as required by read_binary_columns. REAL values go through
+# their text form so they widen to the same float64 as pd.read_sql returns (23.45, not 23.450000762939453)
+def binary_float(column):
+    return f"COALESCE({column}::text::float8, 'NaN')"
+
+# Reads (datetime_index, metric...) rows in binary form into a float64 frame with a datetime64 index
+def read_etf_frame_binary(query, params, columns):
+    with db_connection() as conn:
+        index, *values = read_binary_columns(conn, query, params, ['timestamp'] + ['float8'] * len(columns))
+    return pd.DataFrame(dict(zip(columns, values)), index=pd.DatetimeIndex(index, name='datetime_index'))
+
+def read_etf_frame_pandas(query, params):
+    with db_connection() as conn:
+        df = pd.read_sql(query, conn, params=params or None)
+    df['datetime_index'] = pd.to_datetime(df['datetime_index'])
+    df.set_index('datetime_index', inplace=True)
+    return df
+
+# Reads the long-format ETF table with one indexed scan and pivots to one column per ticker (per metric)
+def load_etf_df_long(column_name, tickers, start_date=None, end_date=None, columns=None, reader='binary'):
+    tickers = [ticker_key(ticker) for ticker in tickers]
+    conditions, params = date_range_filter('datetime_index', start_date, end_date)
+
+    if(column_name[0] == 'all' and len(tickers) == 1):
+        columns = columns or ETF_COLUMNS
+        where = ' AND '.join(['ticker = %s'] + conditions)
+        if reader == 'binary':
+            query = f"SELECT datetime_index, {', '.join([binary_float(col) for col in columns])} FROM {ETF_TABLE} WHERE {where} ORDER BY datetime_index"
+            return read_etf_frame_binary(query, [tickers[0]] + params, columns)
+        query = f"SELECT datetime_index, {', '.join(columns)} FROM {ETF_TABLE} WHERE {where} ORDER BY datetime_index"
+        return read_etf_frame_pandas(query, [tickers[0]] + params)
+
+    where = ' AND '.join(['ticker = ANY(%s)'] + conditions)
+    if(len(column_name) > 1):
+        output_columns = [f"{ticker}_{col}" for ticker in tickers for col in column_name]
+    else:
+        output_columns = tickers
+
+    if reader == 'binary':
+        # Tickers travel as their 1-based position in the tickers list so every binary field is fixed width
+        query = f"""
+            SELECT array_position(%s::text[], ticker), datetime_index, {', '.join([binary_float(col) for col in column_name])}
+            FROM {ETF_TABLE} WHERE {where} ORDER BY datetime_index
+        """
+        with db_connection() as conn:
+            positions, index, *values = read_binary_columns(conn, query, [tickers, tickers] + params,
+                                                            ['int4', 'timestamp'] + ['float8'] * len(column_name))
+        # Client-side pivot: scatter each metric into a date x ticker matrix
+        dates, rows = np.unique(index, return_inverse=True)
+        matrices = {}
+        for col, col_values in zip(column_name, values):
+            matrices[col] = np.full((len(dates), len(tickers)), np.nan)
+            matrices[col][rows, positions - 1] = col_values
+        frame_columns = [matrices[col][:, i] for i in range(len(tickers)) for col in column_name]
+        return pd.DataFrame(dict(zip(output_columns, frame_columns)), index=pd.DatetimeIndex(dates, name='datetime_index'))
+
+    query = f"""
+        SELECT ticker, datetime_index, {', '.join(column_name)} FROM {ETF_TABLE}
+        WHERE {where}
+        ORDER BY datetime_index;
+    """
+    with db_connection() as conn:
+        long_df = pd.read_sql(query, conn, params=[tickers] + params)
+    long_df['datetime_index'] = pd.to_datetime(long_df['datetime_index'])
+
+    df = long_df.pivot(index='datetime_index', columns='ticker', values=column_name)
+    df = df.reindex(columns=pd.MultiIndex.from_product([column_name, tickers]))
+    df = df.swaplevel(axis=1)[[(ticker, col) for ticker in tickers for col in column_name]]
+    df.columns = output_columns
+    return df
+
+# Date of the most recent stored row for a ticker. For several tickers, the date of the last row load_etf_df
+# returns for them: the latest of any of them in the long table, the first one's in the joined wide tables
+def load_etf_last_date(tickers):
+    if isinstance(tickers, str):
+        tickers = [tickers]
+    if ETF_STORAGE == 'long':
+        query, params = f"SELECT MAX(datetime_index) FROM {ETF_TABLE} WHERE ticker = ANY(%s);", ([ticker_key(ticker) for ticker in tickers],)
+    else:
+        query, params = f"SELECT MAX(datetime_index) FROM {ticker_key(tickers[0])};", None
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        last_date = cur.fetchone()[0]
+        cur.close()
+    return pd.Timestamp(last_date)
+
+# start_date/end_date (inclusive) restrict the rows read, columns restricts the 'all' single-ticker read
+# reader='binary' decodes a binary COPY straight into NumPy arrays, reader='pandas' goes through pd.read_sql
+def load_etf_df(column_name, tickers=TICKER_LIST, start_date=None, end_date=None, columns=None, reader='binary'):
     if isinstance(column_name, str):
         column_name = [column_name]  # Convert to list for consistency
+    if ETF_STORAGE == 'long':
+        return load_etf_df_long(column_name, tickers, start_date, end_date, columns, reader)
 
-    conn = get_db_connection()
+    tickers = ['sp500' if ticker == 'S&P 500' else ticker for ticker in tickers]
     df = pd.DataFrame()
 
     if(column_name[0] == 'all' and len(tickers) == 1):
         table_name = tickers[0]
-        query = f"SELECT * FROM {table_name};"
-        df = pd.read_sql(query, conn)
-        df['datetime_index'] = pd.to_datetime(df['datetime_index'])
-        df.set_index('datetime_index', inplace=True)
-        conn.close()
-        return df
+        conditions, params = date_range_filter('datetime_index', start_date, end_date)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        if reader == 'binary':
+            if not columns:
+                with db_connection() as conn:
+                    cur = conn.cursor()
+                    columns = [col for col in get_table_columns(cur, table_name.lower()) if col != 'datetime_index']
+                    cur.close()
+            query = f"SELECT datetime_index, {', '.join([binary_float(col) for col in columns])} FROM {table_name}{where} ORDER BY datetime_index"
+            return read_etf_frame_binary(query, params, columns)
+        query = f"SELECT {', '.join(['datetime_index'] + columns) if columns else '*'} FROM {table_name}"
+        if conditions:
+            query += f"{where} ORDER BY datetime_index"
+        return read_etf_frame_pandas(query, params)
 
 
     # Build the SQL query
-    select_statements = [f"{tickers[0]}.datetime_index"] # if i == 0 else '' for i, ticker in enumerate(tickers)]
-
+    ticker_columns = [(ticker, col) for ticker in tickers for col in column_name]
     if(len(column_name) > 1):
-        select_statements += [f"{ticker}.{col} AS {ticker}_{col}" for ticker in tickers for col in column_name]
+        output_columns = [f"{ticker}_{col}" for ticker, col in ticker_columns]
     else:
-        select_statements += [f"{ticker}.{col} AS {ticker}" for ticker in tickers for col in column_name]
+        output_columns = [ticker for ticker, col in ticker_columns]
+
+    select_statements = [f"{tickers[0]}.datetime_index"] # if i == 0 else '' for i, ticker in enumerate(tickers)]
+    if reader == 'binary':
+        select_statements += [binary_float(f"{ticker}.{col}") for ticker, col in ticker_columns]
+    else:
+        select_statements += [f"{ticker}.{col} AS {name}" for (ticker, col), name in zip(ticker_columns, output_columns)]
 
     query = f"SELECT {', '.join(select_statements)} FROM {tickers[0]}"
     for ticker in tickers[1:]:
         query += f" LEFT JOIN {ticker} ON {tickers[0]}.datetime_index = {ticker}.datetime_index"
+
+    conditions, params = date_range_filter(f"{tickers[0]}.datetime_index", start_date, end_date)
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
         
     # Execute the query and load the data into a DataFrame
-    df = pd.read_sql(query, conn)
-    df['datetime_index'] = pd.to_datetime(df['datetime_index'])
-    df.set_index('datetime_index', inplace=True)
-    conn.close()
+    if reader == 'binary':
+        df = read_etf_frame_binary(query + f" ORDER BY {tickers[0]}.datetime_index", params, [col.lower() for col in output_columns])
+    else:
+        if conditions:
+            query += f" ORDER BY {tickers[0]}.datetime_index"
+        df = read_etf_frame_pandas(query, params)
     
     
     if (column_name == 'volatility'):
@@ -75,37 +241,129 @@ def load_etf_df(column_name, tickers=TICKER_LIST):
 
 
 # Card 2: Macro Data 
+# Longest timeframe (num_years) the dashboard offers, cached macro frames always cover it
+MACRO_CACHE_YEARS = 4
+
+# FRED requests in flight at once, and the minimum spacing between request starts (FRED allows 120 per minute)
+FRED_MAX_WORKERS = int(os.environ.get('FRED_MAX_WORKERS', 4))
+FRED_MIN_INTERVAL = float(os.environ.get('FRED_MIN_INTERVAL', 0.5))
+fred_rate_lock = threading.Lock()
+fred_next_request = 0.0
+
+def wait_for_fred_slot():
+    global fred_next_request
+    with fred_rate_lock:
+        now = time.monotonic()
+        wait = fred_next_request - now
+        fred_next_request = max(now, fred_next_request) + FRED_MIN_INTERVAL
+    if wait > 0:
+        time.sleep(wait)
+
+# Downloads each FRED series in start_dates from its start date on, in a rate-limited thread pool
+def fetch_fred_series(start_dates, end_date=None):
+    def fetch(series_id):
+        wait_for_fred_slot()
+        return fred.get_series(series_id, start_dates[series_id], end_date)
+
+    series_ids = list(start_dates.keys())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=FRED_MAX_WORKERS) as executor:
+        return dict(zip(series_ids, executor.map(fetch, series_ids)))
+
+# Latest stored observation date for each series in the FRED store
+def load_fred_last_dates(series_ids):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        create_fred_table(cur)
+        cur.execute(f"""
+            SELECT series_id, MAX(date) FROM {FRED_TABLE}
+            WHERE series_id = ANY(%s)
+            GROUP BY series_id;
+        """, (list(series_ids),))
+        last_dates = dict(cur.fetchall())
+        cur.close()
+    return last_dates
+
+# Stored observations from start_date on for several series, read with one indexed query
+# Series without stored observations are left out of the returned dict
+def load_fred_series(series_ids, start_date):
+    series_ids = list(series_ids)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        create_fred_table(cur)
+        cur.close()
+        positions, dates, values = read_binary_columns(conn, f"""
+            SELECT array_position(%s::text[], series_id)::int4, date::timestamp, COALESCE(value, 'NaN')
+            FROM {FRED_TABLE}
+            WHERE series_id = ANY(%s) AND date >= %s
+            ORDER BY series_id, date
+        """, (series_ids, series_ids, start_date), ['int4', 'timestamp', 'float8'])
+
+    series = {}
+    for position, series_id in enumerate(series_ids, start=1):
+        rows = positions == position
+        if rows.any():
+            series[series_id] = pd.Series(values[rows], index=pd.DatetimeIndex(dates[rows]))
+    return series
+
+# Appends the observations after each series' last stored date (FRED observation_start) to the store,
+# series that are not stored yet are backfilled from start_date
+def update_fred_store(series_ids, start_date):
+    unique_ids = list(dict.fromkeys([series_id for series_id in series_ids if len(series_id) > 0]))
+    last_dates = load_fred_last_dates(unique_ids)
+    start_dates = {series_id: last_dates[series_id] + timedelta(days=1) if series_id in last_dates else start_date
+                   for series_id in unique_ids}
+    save_fred_observations(fetch_fred_series(start_dates))
+
+# Builds a group's traces from downloaded series, deriving the YoY and diff variants from the shared series
+def build_macro_df(group, series):
+    data = {}
+    for trace in MACRO_TRACE_DICT[group]:
+        if(len(trace.ticker) == 0):
+            continue
+        trace_series = series[trace.ticker].copy()
+        if(trace.yoy == True):
+            trace_series = calculate_yoy(trace_series)
+        if(trace.name == 'Nonfarm Payrolls 1M Change'):
+            trace_series = trace_series.diff()*1000
+        data[trace.name] = trace_series
+        
+    df = pd.DataFrame(data)
+    df.index = pd.to_datetime(df.index)
+    df.interpolate(method='time', inplace = True)
+    return df
+
+# Series IDs behind a group's traces
+def macro_series_ids(group):
+    return [trace.ticker for trace in MACRO_TRACE_DICT[group] if len(trace.ticker) > 0]
+
+# Appends new FRED observations to the store, then rebuilds and caches every group in MACRO_TRACE_DICT from it
+# generation: cache generation to write to, the current one by default
+def refresh_macro_data(num_years, generation=None):
+    start_date = datetime(datetime.now().year - num_years - 1, 1, 1)
+    series_ids = list(dict.fromkeys([series_id for group in MACRO_TRACE_DICT.keys() for series_id in macro_series_ids(group)]))
+    update_fred_store(series_ids, start_date)
+    series = load_fred_series(series_ids, start_date)
+    for group in MACRO_TRACE_DICT.keys():
+        load_macro_frame.store(build_macro_df(group, series), group, generation=generation)
+
+# Builds a group's frame from the FRED store, FRED itself is only called for series that were never stored
+def load_macro_df(group, start_date):
+    series_ids = macro_series_ids(group)
+    series = load_fred_series(series_ids, start_date)
+    if any(series_id not in series for series_id in series_ids):
+        update_fred_store(series_ids, start_date)
+        series = load_fred_series(series_ids, start_date)
+    return build_macro_df(group, series)
+
+@cached('cache_key_{}', refresh_after=86400)
+def load_macro_frame(group):
+    return load_macro_df(group, datetime(datetime.now().year - MACRO_CACHE_YEARS - 1, 1, 1))
+
 def load_macro_data(group, num_years):
     end_date = datetime.now()
     start_year = end_date.year - num_years - 1
-    start_date = datetime(start_year,1,1)
-
-    cache_key = f'cache_key_{group}'
-    cached_data = mc.get(cache_key)
-    if cached_data is not None:
-        data = pd.read_csv(io.StringIO(cached_data), index_col = 0, parse_dates = True)
-        df = pd.DataFrame(data)
-        df.index = pd.to_datetime(df.index)
-        
-    else:
-        traces = MACRO_TRACE_DICT[group]
-        data = {}
-        for trace in traces:
-            if(len(trace.ticker) == 0):
-                continue
-            trace_series = fred.get_series(trace.ticker, start_date, end_date)
-            if(trace.yoy == True):
-                trace_series = calculate_yoy(trace_series)
-            if(trace.name == 'Nonfarm Payrolls 1M Change'):
-                trace_series = trace_series.diff()*1000
-            data[trace.name] = trace_series
-            
-        df = pd.DataFrame(data)
-        df.index = pd.to_datetime(df.index)
-        df.interpolate(method='time', inplace = True)
-
-        csv_data = df.to_csv(index=True)
-        mc.set(cache_key, csv_data, time=86400)
+
+    df = load_macro_frame(group)
         
     if(group == 'interest_rates'):
         df['3m10y Spread'] = df['10-Year Yield'] - df['3-Month Yield']  
@@ -121,9 +379,27 @@ def load_macro_data(group, num_years):
 
 
 # Card 3: Watchlist
+# Column order of the watchlist frame
+WATCHLIST_COLUMNS = ['Ticker', 'Name', 'Sector', 'Market Cap', 'Price', 'PE Ratio', 'Earnings Growth', 'EPS',
+                     '%-Change (1M)', '%-Change (6M)', '200 day Avg', 'PEG Ratio', 'Beta']
+# Columns computed from the batched price history, and the calendar days downloaded for them (enough for 200 trading days)
+PRICE_HISTORY_COLUMNS = ['Price', '%-Change (1M)', '%-Change (6M)', '200 day Avg']
+WATCHLIST_HISTORY_DAYS = 300
+# Watchlist pages kept in memory per sector, sort order and page, for LOCAL_CACHE_TTL seconds
+WATCHLIST_PAGE_CACHE_SIZE = int(os.environ.get('WATCHLIST_PAGE_CACHE_SIZE', 256))
+# Fewest tickers a constituent list scrape must return to be recorded
+SP500_MIN_CONSTITUENTS = 450
+# Watchlist frame column -> WATCHLIST_TABLE column
+WATCHLIST_TABLE_COLUMNS = {'Ticker': 'ticker', 'Name': 'name', 'Sector': 'sector', 'Market Cap': 'market_cap', 'Price': 'price',
+                           'PE Ratio': 'pe_ratio', 'Earnings Growth': 'earnings_growth', 'EPS': 'eps', '%-Change (1M)': 'change_1m',
+                           '%-Change (6M)': 'change_6m', '200 day Avg': 'avg_200d', 'PEG Ratio': 'peg_ratio', 'Beta': 'beta'}
+# How long each field group stays fresh, identity (name/sector) is only fetched for tickers that are not stored yet
+WATCHLIST_REFRESH_INTERVALS = {'fundamentals': timedelta(days=7), 'prices': timedelta(hours=20)}
+
 #Update stock data
+# Fundamentals from Yahoo's quote summary, the price history columns come from calculate_watchlist_price_columns
 def fetch_stock_data(ticker):
-    stock = yf.Ticker(ticker)
+    stock = yf.Ticker(yahoo_symbol(ticker))
     info = stock.info
     
     drop_stock = False
@@ -146,11 +422,6 @@ def fetch_stock_data(ticker):
         market_cap = 'N/A'
         drop_stock = True
     
-    try:
-        open_price = info.get('open', 'N/A')
-    except:
-        open_price = 'N/A'
-    
     try:
         pe_ratio = info.get('trailingPE', None)
     except:
@@ -166,11 +437,6 @@ def fetch_stock_data(ticker):
     except:
         eps = 'N/A'
     
-    try:
-        twoHundredDayAverage = info.get('twoHundredDayAverage', 'N/A')
-    except:
-        twoHundredDayAverage = 'N/A'
-    
     try:
         pegRatio = info.get('pegRatio', 'N/A')
     except:
@@ -181,16 +447,6 @@ def fetch_stock_data(ticker):
     except:
         beta = 'N/A'
     
-    try:
-        one_month_change = stock.history(period='1mo')['Close'].pct_change().iloc[-1] * 100
-    except:
-        one_month_change = 'N/A'
-    
-    try:
-        six_month_change = stock.history(period='6mo')['Close'].pct_change().iloc[-1] * 100
-    except:
-        six_month_change = 'N/A'
-    
     if drop_stock:
         return None
     
@@ -199,23 +455,60 @@ def fetch_stock_data(ticker):
         'Name': name,
         'Sector': sector,
         'Market Cap': market_cap if market_cap is not None else 'N/A',
-        'Price': open_price if open_price is not None else 'N/A',
         'PE Ratio': pe_ratio if pe_ratio is not None else 'N/A',
         'Earnings Growth': earnings_growth if earnings_growth is not None else 'N/A',
         'EPS': eps if eps is not None else 'N/A',
-        '%-Change (1M)': one_month_change,
-        '%-Change (6M)': six_month_change,
-        '200 day Avg': twoHundredDayAverage if twoHundredDayAverage is not None else 'N/A',
         'PEG Ratio': pegRatio if pegRatio is not None else 'N/A',
         'Beta': beta if beta is not None else 'N/A'
     }
 
-def get_stock_ticker_data():
+# Latest close, 1M/6M % change and 200 day average close for every ticker, from one batched history download
+def calculate_watchlist_price_columns(tickers):
+    close = pd.DataFrame()
+    if tickers:
+        close = fetch_etf_data_batch(tickers, datetime.now() - timedelta(days=WATCHLIST_HISTORY_DAYS))['close'].dropna(how='all')
+    if close.empty:
+        return pd.DataFrame(np.nan, index=tickers, columns=PRICE_HISTORY_COLUMNS)
+
+    last_date = close.index[-1]
+    last_close = close.ffill().iloc[-1]
+
+    def change_since(offset):
+        window = close[close.index >= last_date - offset]
+        return (last_close / window.bfill().iloc[0] - 1) * 100
+
+    return pd.DataFrame({
+        'Price': last_close,
+        '%-Change (1M)': change_since(pd.DateOffset(months=1)),
+        '%-Change (6M)': change_since(pd.DateOffset(months=6)),
+        '200 day Avg': close.iloc[-200:].mean(),
+    })
+
+def fetch_sp500_tickers():
     url = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
     table = pd.read_html(url)
     df = table[0]
-    tickers = df['Symbol'].tolist()
-
+    return df['Symbol'].tolist()
+
+# Records S&P 500 adds and removals in CONSTITUENTS_TABLE, run on its own low-frequency schedule
+def update_sp500_constituents():
+    tickers = fetch_sp500_tickers()
+    # A truncated scrape would otherwise close most of the index
+    if len(tickers) < SP500_MIN_CONSTITUENTS:
+        raise ValueError(f"Only {len(tickers)} S&P 500 constituents found, keeping the stored list.")
+    added, removed = record_constituent_changes(tickers)
+    return {'added': added, 'removed': removed}
+
+# Current constituents from the database, only scraping the list when it has never been stored
+def get_sp500_tickers():
+    tickers = load_constituents()
+    if not tickers:
+        update_sp500_constituents()
+        tickers = load_constituents()
+    return tickers
+
+# Identity and fundamentals columns for several tickers, one quote summary request per ticker
+def fetch_watchlist_info(tickers):
     data = []
     with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
         future_to_ticker = {executor.submit(fetch_stock_data, ticker): ticker for ticker in tickers}
@@ -224,59 +517,151 @@ def get_stock_ticker_data():
             if result:
                 data.append(result)
 
-    return pd.DataFrame(data)
+    df = pd.DataFrame(data, columns=[col for col in WATCHLIST_COLUMNS if col not in PRICE_HISTORY_COLUMNS])
+    df = df.rename(columns=WATCHLIST_TABLE_COLUMNS)
+    for col in WATCHLIST_FIELD_GROUPS['fundamentals']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
 
-def create_watchlist_df(sector_ticker='all'):
-    cache_key = 'daily_stock_data'
-    cached_data = mc.get(cache_key)
-    if cached_data is not None:
-        df = pd.read_csv(io.StringIO(cached_data))
+# When each stored ticker's field groups were last fetched
+def load_watchlist_refresh_times():
+    with db_connection() as conn:
+        cur = conn.cursor()
+        create_watchlist_table(cur)
+        columns = [f'{group}_updated_at' for group in WATCHLIST_FIELD_GROUPS]
+        cur.execute(f"SELECT ticker, {', '.join(columns)} FROM {WATCHLIST_TABLE};")
+        df = pd.DataFrame(cur.fetchall(), columns=['ticker'] + columns).set_index('ticker')
+        cur.close()
+    return df
 
-    else:
-        df = get_stock_ticker_data()
-        csv_data = df.to_csv(index=False)
-        mc.set(cache_key, csv_data, time=82800)
-    
-    
-    df.reset_index(inplace=True)
-    df = df[df['Sector']!='Unknown']
-    
-    sector_mapping = {
-        'Financial Services': 'Financials',
-        'Basic Materials': 'Materials',
-        'Consumer Cyclical': 'Cons. Cyclical',
-        'Communication Services': 'Communications',
-        'Consumer Defensive': 'Cons. Defensive'
-    }
-    
-    df['Sector'] = df['Sector'].replace(sector_mapping)
-    
+# Brings WATCHLIST_TABLE up to date for tickers, fetching only the field groups that are missing or older than
+# WATCHLIST_REFRESH_INTERVALS. Returns the number of tickers refreshed per group
+def update_watchlist_table(tickers):
+    now = datetime.now()
+    refresh_times = load_watchlist_refresh_times().reindex(tickers)
+
+    def stale(group):
+        updated_at = refresh_times[f'{group}_updated_at']
+        if group in WATCHLIST_REFRESH_INTERVALS:
+            updated_at = updated_at.where(updated_at >= now - WATCHLIST_REFRESH_INTERVALS[group])
+        return updated_at.index[updated_at.isna()].tolist()
+
+    new_tickers = stale('identity')
+    fundamentals_tickers = [ticker for ticker in stale('fundamentals') if ticker not in new_tickers]
+    info = fetch_watchlist_info(new_tickers + fundamentals_tickers)
+    # An empty or throttled quote summary comes back as the 'N/A'/'Unknown' placeholders, nothing from it is saved
+    # so the ticker is fetched again next time
+    info = info[(info['name'] != 'N/A') & (info['sector'] != 'Unknown')].copy()
+    info['identity_updated_at'] = now
+    info['fundamentals_updated_at'] = now
+    is_new = info['ticker'].isin(new_tickers)
+    save_watchlist_rows(info[is_new])
+    save_watchlist_rows(info.loc[~is_new, ['ticker', 'fundamentals_updated_at'] + WATCHLIST_FIELD_GROUPS['fundamentals']])
+
+    # Prices are only stored for tickers that have a row, so a failed identity fetch is retried next time
+    stored = set(refresh_times.index[refresh_times['identity_updated_at'].notna()]) | set(info.loc[is_new, 'ticker'])
+    price_tickers = [ticker for ticker in stale('prices') if ticker in stored]
+    prices = calculate_watchlist_price_columns(price_tickers).rename(columns=WATCHLIST_TABLE_COLUMNS)
+    prices = prices.rename_axis('ticker').reset_index()
+    prices['prices_updated_at'] = now
+    save_watchlist_rows(prices)
+
+    delete_watchlist_rows_except(tickers)
+    return {'identity': int(is_new.sum()), 'fundamentals': int((~is_new).sum()), 'prices': len(prices)}
+
+# Watchlist frame read back from WATCHLIST_TABLE, with the same columns and 'N/A'/'Unknown' placeholders as the fetchers
+def load_watchlist_frame():
+    with db_connection() as conn:
+        cur = conn.cursor()
+        create_watchlist_table(cur)
+        cur.execute(f"SELECT {', '.join(WATCHLIST_TABLE_COLUMNS.values())} FROM {WATCHLIST_TABLE} ORDER BY ticker;")
+        df = pd.DataFrame(cur.fetchall(), columns=list(WATCHLIST_TABLE_COLUMNS.keys()))
+        cur.close()
+
+    df['Sector'] = df['Sector'].fillna('Unknown')
+    df = df.astype(object).where(df.notna(), 'N/A')
+    return df[WATCHLIST_COLUMNS]
+
+@cached('daily_stock_data', refresh_after=82800)
+def get_stock_ticker_data():
+    update_watchlist_table(get_sp500_tickers())
+    return load_watchlist_frame()
+
+# Updates the stale parts of the watchlist table, then overwrites the cached frame in place, so readers keep
+# the old value until the new one is written
+def refresh_watchlist_data(generation=None):
+    summary = update_watchlist_table(get_sp500_tickers())
+    get_stock_ticker_data.store(load_watchlist_frame(), generation=generation)
+    return summary
+
+# Watchlist sector shown for a sector ETF, the consumer and communications sectors use the shortened display names
+def watchlist_sector(sector_ticker):
+    ticker_to_sector = {'XLY': 'Cons. Cyclical',
+                        'XLC': 'Communications',
+                        'XLP': 'Cons. Defensive'}
+    return ticker_to_sector.get(sector_ticker, ETF_TO_SECTOR.get(sector_ticker))
+
+def watchlist_sector_condition(sector_ticker):
     if sector_ticker == 'all':
-        return df
-    else:
-        if sector_ticker in ['XLY', 'XLC', 'XLP']:
-            ticker_to_sector = {'XLY': 'Cons. Cyclical',
-                                'XLC':'Communications',
-                                'XLP':'Cons. Defensive'}
-            sector = ticker_to_sector[sector_ticker]
-        else:
-            sector = ETF_TO_SECTOR[sector_ticker]
-        df = df[df['Sector'] == sector]
-    
-    return df
+        return "display_sector IS NOT NULL", []
+    return "display_sector = %s", [watchlist_sector(sector_ticker)]
+
+def watchlist_table_column(col):
+    return WATCHLIST_TABLE_COLUMNS[col] if col != 'Sector' else 'display_sector'
+
+# Watchlist rows of one sector ETF (or of every known sector for 'all') as DataTable records, filtered on the
+# indexed display_sector column. sort_by is a DataTable sort_by list, missing values sort last in either direction.
+# Returns rows offset to offset + limit (all of them when limit is None) and the number of matching rows, which
+# comes with the rows in the same query and is 0 when none are returned
+def query_watchlist_records(sector_ticker='all', sort_by=None, offset=0, limit=None):
+    columns = [watchlist_table_column(col) for col in WATCHLIST_COLUMNS]
+    condition, params = watchlist_sector_condition(sector_ticker)
+
+    # Column ids are checked against WATCHLIST_COLUMNS before they reach the query
+    order = [f"{watchlist_table_column(sort['column_id'])} {'DESC' if sort['direction'] == 'desc' else 'ASC'} NULLS LAST"
+             for sort in sort_by or [] if sort['column_id'] in WATCHLIST_COLUMNS]
+    query = f"SELECT {', '.join(columns)}, COUNT(*) OVER () FROM {WATCHLIST_TABLE} WHERE {condition} ORDER BY {', '.join(order + ['ticker'])}"
+    if limit is not None:
+        query += " LIMIT %s OFFSET %s"
+        params += [limit, offset]
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        ensure_watchlist_table(cur)
+        cur.execute(query + ";", params)
+        rows = cur.fetchall()
+        cur.close()
+    records = [{col: value if value is not None else 'N/A' for col, value in zip(WATCHLIST_COLUMNS, row)} for row in rows]
+    return records, rows[0][-1] if rows else 0
+
+def get_watchlist_records(sector_ticker='all', sort_by=None, offset=0, limit=None):
+    return query_watchlist_records(sector_ticker, sort_by, offset, limit)[0]
+
+watchlist_pages = LocalCache(max_size=WATCHLIST_PAGE_CACHE_SIZE)
+
+# One page of the watchlist for a page_action='custom' DataTable. Returns (records, page_count)
+# Pages are memoized under the current cache generation, so a published refresh is picked up right away
+def get_watchlist_page(sector_ticker='all', sort_by=None, page_current=0, page_size=50):
+    sort_key = ','.join(f"{sort['column_id']}:{sort['direction']}" for sort in sort_by or [])
+    key = generation_key(f"watchlist_page_{sector_ticker}_{sort_key}_{page_current or 0}_{page_size}")
+    page = watchlist_pages.get(key)
+    if page is None:
+        page_current = page_current or 0
+        records, count = query_watchlist_records(sector_ticker, sort_by, page_current * page_size, page_size)
+        # Past the last page, e.g. after the table shrank, no row carries the count, so it is read first to find the last page
+        if not records and page_current > 0:
+            count = query_watchlist_records(sector_ticker, sort_by, 0, 1)[1]
+            page_current = max(0, -(-count // page_size) - 1)
+            records, count = query_watchlist_records(sector_ticker, sort_by, page_current * page_size, page_size)
+        page = (records, max(1, -(-count // page_size)))
+        watchlist_pages.set(key, page)
+    return page
 
+def create_watchlist_df(sector_ticker='all'):
+    return pd.DataFrame(get_watchlist_records(sector_ticker), columns=WATCHLIST_COLUMNS)
 
-# Card 4: Summary Graphs
 def get_sector_weightings_data():
-    cache_key = 'daily_stock_data'
-    cached_data = mc.get(cache_key)
-    if cached_data is not None:
-        df = pd.read_csv(io.StringIO(cached_data))
-
-    else:
-        df = get_stock_ticker_data()
-        csv_data = df.to_csv(index=False)
-        mc.set(cache_key, csv_data, time=82800)
+    df = get_stock_ticker_data()
 
     #df = pd.read_csv('daily_stock_data.csv', index_col=0)
     df = df.dropna(subset=['Name'])
@@ -286,17 +671,17 @@ def get_sector_weightings_data():
 
     return sector_weightings
 
+@cached('risk_return_{}', refresh_after=86400)
 def get_quarterly_annualized_risk_return(ticker):
-    cache_key = f'risk_return_{ticker}'
-    cached_data = mc.get(cache_key)
-    if cached_data is not None:
-        data = pd.read_csv(io.StringIO(cached_data), index_col = 0)
-        df = pd.DataFrame(data)
-        df.index = pd.to_datetime(df.index)
-        return df
+    return calculate_quarterly_risk_return(ticker)
 
-    df = fetch_etf_data(ticker, datetime(2019, 12,31))
+# prices: optional fetch_etf_data_batch frame containing ticker, to avoid a separate download
+def calculate_quarterly_risk_return(ticker, prices=None):
     start_date = datetime(2019, 12,31)
+    if prices is None:
+        df = fetch_etf_data(ticker, start_date)
+    else:
+        df = ticker_prices(prices, ticker)
     df = df[df.index >= start_date]
         
     df['Total Value'] = df['close'] + df['dividends']
@@ -329,7 +714,32 @@ def get_quarterly_annualized_risk_return(ticker):
                     'Annualized Risk': annualized_risk
                 })
 
-    result_df = pd.DataFrame(results)
-    csv_data = result_df.to_csv(index=True)
-    mc.set(cache_key, csv_data, time=86400)
-    return result_df
+    return pd.DataFrame(results)
+
+# Risk/return for several tickers. Stale entries are refreshed in the background, and the tickers with nothing
+# cached that this process holds the lease for are served by one batched price download. The rest are left
+# to the process already building them
+def get_sector_risk_returns(tickers):
+    results = {ticker: get_quarterly_annualized_risk_return.peek(ticker) for ticker in tickers}
+    missing = [ticker for ticker, df in results.items() if df is None]
+    leased = [ticker for ticker in missing if cache_acquire_lease(get_quarterly_annualized_risk_return.key(ticker))]
+    try:
+        if leased:
+            prices = fetch_etf_data_batch(leased, datetime(2019, 12,31))
+            for ticker in leased:
+                results[ticker] = calculate_quarterly_risk_return(ticker, prices)
+                get_quarterly_annualized_risk_return.store(results[ticker], ticker)
+    finally:
+        for ticker in leased:
+            cache_release_lease(get_quarterly_annualized_risk_return.key(ticker))
+
+    for ticker in missing:
+        if ticker not in leased:
+            results[ticker] = get_quarterly_annualized_risk_return(ticker)
+    return results
+
+# Recomputes and overwrites every ticker's cached risk/return from one batched price download
+def refresh_sector_risk_returns(tickers, generation=None):
+    prices = fetch_etf_data_batch(tickers, datetime(2019, 12,31))
+    for ticker in tickers:
+        get_quarterly_annualized_risk_return.store(calculate_quarterly_risk_return(ticker, prices), ticker, generation=generation)
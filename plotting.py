@@ -1,12 +1,31 @@
+import logging
 import pandas as pd
 from datetime import datetime
 import plotly.graph_objs as go
 import plotly.express as px
+from plotly.io.json import to_json_plotly
 from datetime import datetime, timedelta
 
 #from graph_tools import draw_year_dividers, format_graphs
-from load_data import load_etf_df, load_macro_data, get_sector_weightings_data, get_quarterly_annualized_risk_return, create_watchlist_df
-from utilities import MACRO_TRACE_DICT, get_interest_rates_columns, draw_year_dividers, format_graphs, SECTOR_ETFS, ETF_TO_SECTOR
+from database import ETF_COLUMNS
+from cache import building_generation, cache_get_json, cache_set_json, generation_key, CACHE_HARD_TTL
+from load_data import load_etf_df, load_etf_last_date, load_macro_data, get_sector_weightings_data, get_sector_risk_returns, create_watchlist_df
+from utilities import MACRO_TRACE_DICT, TICKER_LIST, get_interest_rates_columns, format_graphs, year_divider_shapes, figure_dict, SECTOR_ETFS, ETF_TO_SECTOR, warmup_start_date, GRAPH_MARGIN, GRAPH_YAXIS, GRAPH_XAXIS, GRAPH_BGCOLOR
+
+logger = logging.getLogger(__name__)
+
+METRIC_MAPPINGS = {'Price':'close',
+                   'Year-End Indexed Price':'ytd_pct',
+                   'Volatility':'volatility',
+                   'Dividend Yield':'div_yield',
+                   'Sharpe Ratio':'sharpe',
+                   'RSI':'rsi'}
+
+# Control values the nightly job renders every figure for (timeframe radio, rolling average radio, default maturities),
+# any other combination is rendered live
+FIGURE_TIMEFRAMES = [0, 1, 4]
+FIGURE_ROLLING_WINDOWS = [1, 5, 20, 50, 100]
+DEFAULT_MATURITY = ['2 Year', '10 Year']
 
 
 #Plotting functions for card 1
@@ -30,60 +49,58 @@ def plot_bar_graph(df, metric_name):
 
     min_ticker = etf_performance.idxmin()
 
-    # Create a bar chart for the ETFs
-    fig = go.Figure(go.Bar(
-        x=etf_performance.index,  
-        y=etf_performance.values,
-        text=[ETF_TO_SECTOR.get(ticker, ticker) for ticker in etf_performance.index],  # Hover text as sector names
-        name='ETF Cumulative Performance',
-        marker=dict(color='blue'),
-        hoverinfo="x+text+y"  # Show ticker, sector, and value on hover
-    ))
-
-    # Add a horizontal line for average performance
-    fig.add_shape(
-        type="line",
-        x0=-0.5,  
-        x1=len(etf_performance) - 0.5,  
-        y0=benchmark_value,
-        y1=benchmark_value,
-        line=dict(color="red", width=2),
-        name=benchmark_name
-    )
-
-    # Position the annotation above the shortest bar
-    fig.add_annotation(
-        x=etf_performance.index.get_loc(min_ticker),  # Place the annotation above the shortest bar
-        y=benchmark_value,  
-        text=benchmark_name,
-        showarrow=True,
-        yshift=10,
-        font=dict(color="red"),
-        arrowhead=2
-    )
-    # Update layout
-    fig.update_layout(
-        title=f"{metric_name} by Sector",
-        xaxis_title='Ticker',
-        yaxis_title=metric_name,
-        yaxis=dict(showgrid=True, gridcolor='rgb(200,200,200)'),
-        plot_bgcolor='rgb(255,255,255)',
-        autosize=True,
-        margin=dict(l=20, r=20, t=30, b=30)
-    )
-    return fig
+    # Bar chart for the ETFs, with a horizontal benchmark line labelled above the shortest bar
+    bars = {
+        'hoverinfo': 'x+text+y',  # Show ticker, sector, and value on hover
+        'marker': {'color': 'blue'},
+        'name': 'ETF Cumulative Performance',
+        'text': [ETF_TO_SECTOR.get(ticker, ticker) for ticker in etf_performance.index],  # Hover text as sector names
+        'x': etf_performance.index,
+        'y': etf_performance.values,
+        'type': 'bar',
+    }
+    benchmark_line = {
+        'line': {'color': 'red', 'width': 2},
+        'name': benchmark_name,
+        'type': 'line',
+        'x0': -0.5,
+        'x1': len(etf_performance) - 0.5,
+        'y0': benchmark_value,
+        'y1': benchmark_value,
+    }
+    benchmark_label = {
+        'arrowhead': 2,
+        'font': {'color': 'red'},
+        'showarrow': True,
+        'text': benchmark_name,
+        'x': etf_performance.index.get_loc(min_ticker),
+        'y': benchmark_value,
+        'yshift': 10,
+    }
+    return figure_dict([bars], {
+        'shapes': [benchmark_line],
+        'annotations': [benchmark_label],
+        'yaxis': {'title': {'text': metric_name}, 'showgrid': True, 'gridcolor': 'rgb(200,200,200)'},
+        'margin': {'l': 20, 'r': 20, 't': 30, 'b': 30},
+        'title': {'text': f"{metric_name} by Sector"},
+        'xaxis': {'title': {'text': 'Ticker'}},
+        'plot_bgcolor': GRAPH_BGCOLOR,
+        'autosize': True,
+    })
 
 def plot_metric(metric_name, num_years=2, num_periods=1, bar=False):
-    metric_mappings = {'Price':'close',
-                  'Year-End Indexed Price':'ytd_pct',
-                  'Volatility':'volatility',
-                  'Dividend Yield':'div_yield',
-                  'Sharpe Ratio':'sharpe',
-                  'RSI':'rsi'}
-    default_not_visible = ['XLC', 'XLP', 'XLV', 'XLY', 'XLB']
-
+    end_date = datetime.now()
+    start_year = end_date.year - num_years
+    start_date = datetime(start_year, 1, 1)
 
-    df = load_etf_df(metric_mappings[metric_name])
+    # Dividend Yield averages over dividend rows only, so its window warm-up can't be bounded by date
+    if metric_name == 'Dividend Yield':
+        df = load_etf_df(METRIC_MAPPINGS[metric_name])
+    elif bar:
+        # Only the latest row is plotted, which a timeframe start in the future (early January) would leave out
+        df = load_etf_df(METRIC_MAPPINGS[metric_name], start_date=load_etf_last_date(TICKER_LIST))
+    else:
+        df = load_etf_df(METRIC_MAPPINGS[metric_name], start_date=warmup_start_date(start_date, num_periods))
 
     
     name_map = {col: col.upper() for col in df.columns if col != 'sp500'} 
@@ -102,109 +119,83 @@ def plot_metric(metric_name, num_years=2, num_periods=1, bar=False):
     if num_periods > 1:
         df = df.rolling(window=num_periods, min_periods=1).mean()
     
-    end_date = datetime.now()
-    start_year = end_date.year - num_years
-    start_date = datetime(start_year, 1, 1)
     df = df[df.index >= start_date]
+    return plot_line_graph(df, metric_name)
+
+# Figure assembly, plot_line_graph, plot_sector_graph and plot_macro_graph take the frames their plot_* function loaded
+def plot_line_graph(df, metric_name):
+    default_not_visible = ['XLC', 'XLP', 'XLV', 'XLY', 'XLB']
 
-    fig = go.Figure()
+    traces = []
     for column in df.columns:
         sector_name = ETF_TO_SECTOR.get(column, column)  # Get sector name or fallback to column name
-        visibility = 'legendonly' if column in default_not_visible else True
-        fig.add_trace(go.Scatter(
-            x=df.index,
-            y=df[column],
-            mode='lines',
-            name=column,  # Keep the ticker as the legend name
-            visible=visibility,
-            hovertemplate=f'{sector_name}: %{{y:.2f}}<extra></extra>'  
-        ))
-
-    fig.update_layout(
-        title=f"{metric_name} by Sector",
-        yaxis_title=metric_name,
-        autosize=True
-    )
-    fig = draw_year_dividers(fig, df)
-    fig.update_layout(hovermode="x unified")
-
-    return format_graphs(fig)
+        traces.append({
+            'hovertemplate': f'{sector_name}: %{{y:.2f}}<extra></extra>',
+            'mode': 'lines',
+            'name': column,  # Keep the ticker as the legend name
+            'visible': 'legendonly' if column in default_not_visible else True,
+            'x': df.index,
+            'y': df[column].values,
+            'type': 'scatter',
+        })
+
+    return figure_dict(traces, {
+        'title': {'text': f"{metric_name} by Sector"},
+        'yaxis': {'title': {'text': metric_name}, **GRAPH_YAXIS},
+        'autosize': True,
+        'shapes': year_divider_shapes(df.index),
+        'hovermode': 'x unified',
+        'legend': {'orientation': 'v'},
+        'margin': GRAPH_MARGIN,
+        'xaxis': GRAPH_XAXIS,
+        'plot_bgcolor': GRAPH_BGCOLOR,
+    })
 
 def plot_sector_data(ticker, num_years = 1, num_periods = 7):
-    # Load data using the getter functions
-    df = load_etf_df('all', [ticker])
+    end_date = datetime.now()
+    start_year = end_date.year - num_years
+    start_date = datetime(start_year, 1, 1)
+
+    # Load only the plotted columns in their stored order, plus enough history to warm up the rolling average
+    columns = [col for col in ETF_COLUMNS if col != 'dividends']
+    df = load_etf_df('all', [ticker], start_date=warmup_start_date(start_date, num_periods), columns=columns)
     df.index = pd.to_datetime(df.index)
-    df.drop(columns = ['dividends'], inplace = True)
 
     if num_periods > 1:
         df = df.rolling(window=num_periods, min_periods=1).mean()
     
-    metric_mappings = {'Price':'close',
-                  'Year-End Indexed Price':'ytd_pct',
-                  'Volatility':'volatility',
-                  'Dividend Yield':'div_yield',
-                  'Sharpe Ratio':'sharpe',
-                  'RSI':'rsi'}
-    
-    column_mappings = {value: key for key, value in metric_mappings.items()}
-
-    end_date = datetime.now()
-    start_year = end_date.year - num_years
-    start_date = datetime(start_year, 1, 1)
     df = df[df.index >= start_date]
+    return plot_sector_graph(df, ticker)
 
-    # Create figure
-    fig = go.Figure()
-    
+def plot_sector_graph(df, ticker):
+    column_mappings = {value: key for key, value in METRIC_MAPPINGS.items()}
+
+    traces = []
     for column in df.columns:
         if column == 'sharpe':
             continue
-        fig.add_trace(go.Scatter(
-            x=df.index,
-            y=df[column],
-            mode='lines',
-            name=column_mappings[column]
-        ))
-
-    # Add trace for the Sharpe Ratio on the right y-axis
-    fig.add_trace(go.Scatter(
-        x=df.index,
-        y=df['sharpe'],
-        mode='lines',
-        name='Sharpe Ratio',
-        yaxis='y2'  
-    ))
-
-    # Update layout with dual y-axes
-    fig.update_layout(
-        title=f'{ticker} Sector Data',
-        yaxis=dict(
-            title='Primary Metrics',  # Left y-axis title
-            side='left'
-        ),
-        yaxis2=dict(
-            title='Sharpe Ratio',  # Right y-axis title
-            overlaying='y',
-            side='right'
-        ),
-        autosize=True,
-    )
-
-    fig = draw_year_dividers(fig, df)
-
-    fig = format_graphs(fig)
-    fig.update_layout(
-        legend = {
-            'orientation': 'h',
-            'yanchor': 'top',
-        },
-    )
-    fig.update_layout(hovermode="x unified")
-    return fig
+        traces.append({'mode': 'lines', 'name': column_mappings[column], 'x': df.index, 'y': df[column].values, 'type': 'scatter'})
+
+    # Trace for the Sharpe Ratio on the right y-axis
+    traces.append({'mode': 'lines', 'name': 'Sharpe Ratio', 'x': df.index, 'y': df['sharpe'].values, 'yaxis': 'y2', 'type': 'scatter'})
+
+    # Dual y-axes
+    return figure_dict(traces, {
+        'yaxis': {'title': {'text': 'Primary Metrics'}, 'side': 'left', **GRAPH_YAXIS},
+        'yaxis2': {'title': {'text': 'Sharpe Ratio'}, 'overlaying': 'y', 'side': 'right'},
+        'title': {'text': f'{ticker} Sector Data'},
+        'autosize': True,
+        'shapes': year_divider_shapes(df.index),
+        'legend': {'orientation': 'h', 'yanchor': 'top'},
+        'margin': GRAPH_MARGIN,
+        'xaxis': GRAPH_XAXIS,
+        'plot_bgcolor': GRAPH_BGCOLOR,
+        'hovermode': 'x unified',
+    })
 
 
 #Plotting functions for card 2
-def plot_macroeconomic_data(group, num_years, maturity = ['2 Year', '10 Year']):
+def plot_macroeconomic_data(group, num_years, maturity = DEFAULT_MATURITY):
     start_year = datetime.now().year - num_years
     start_date = datetime(start_year,1,1)
     
@@ -217,25 +208,21 @@ def plot_macroeconomic_data(group, num_years, maturity = ['2 Year', '10 Year']):
     if(group == 'interest_rates'):
         columns = get_interest_rates_columns(maturity)
         lines = [trace for trace in traces if trace.name in columns]
-    
-    fig = go.Figure()
+    return plot_macro_graph(df, group, lines, bars)
+
+def plot_macro_graph(df, group, lines, bars):
+    traces = []
     for trace in lines:
         if trace.axis2 == False:
             visibility = 'legendonly' if trace.hidden else True
-            fig.add_trace(go.Scatter(x=df.index, y=df[trace.name], mode='lines', name=trace.name, visible=visibility, zorder = 1))
+            traces.append({'mode': 'lines', 'name': trace.name, 'visible': visibility, 'x': df.index, 'y': df[trace.name].values, 'zorder': 1, 'type': 'scatter'})
     for trace in lines:
         if trace.axis2:
             visibility = 'legendonly' if trace.hidden else True
-            fig.add_trace(go.Scatter(x=df.index, y=df[trace.name], mode='lines', name=trace.name, yaxis='y2', visible=visibility, zorder = 1))
+            traces.append({'mode': 'lines', 'name': trace.name, 'visible': visibility, 'x': df.index, 'y': df[trace.name].values, 'yaxis': 'y2', 'zorder': 1, 'type': 'scatter'})
     
     for trace in bars:
-        fig.add_trace(go.Bar(
-        x=df.index, 
-        y=df[trace.name], 
-        name= trace.name, 
-        yaxis='y2',
-        marker_color='lightgrey'
-        ))
+        traces.append({'marker': {'color': 'lightgrey'}, 'name': trace.name, 'x': df.index, 'y': df[trace.name].values, 'yaxis': 'y2', 'type': 'bar'})
             
             
     title_map = {
@@ -246,32 +233,30 @@ def plot_macroeconomic_data(group, num_years, maturity = ['2 Year', '10 Year']):
         'interest_rates': ['Interest Rates, Yield Spreads, and Monetary Indicators', 'Rate (%)']        
     }
     
-    
-    fig = draw_year_dividers(fig, df)
-    fig = format_graphs(fig)
-    
-    fig.update_layout(
-        title=title_map[group][0],
-        yaxis=dict(title=title_map[group][1]),
-        legend=dict(
-            orientation='h',
-            x=0.5,
-            y=-0.1,
-            xanchor='center',
-            yanchor='top',
-            traceorder='normal'
-        ),
-    )
+    layout = {
+        'shapes': year_divider_shapes(df.index),
+        'legend': {
+            'orientation': 'h',
+            'x': 0.5,
+            'y': -0.1,
+            'xanchor': 'center',
+            'yanchor': 'top',
+            'traceorder': 'normal'
+        },
+        'margin': GRAPH_MARGIN,
+        'yaxis': {**GRAPH_YAXIS, 'title': {'text': title_map[group][1]}},
+        'xaxis': GRAPH_XAXIS,
+        'plot_bgcolor': GRAPH_BGCOLOR,
+        'title': {'text': title_map[group][0]},
+    }
     if(len(title_map[group])>2):
-        fig.update_layout(
-            yaxis2=dict(
-                title=title_map[group][2],  # Right y-axis title
-                overlaying='y',
-                side='right'
-            ),
-        )
+        layout['yaxis2'] = {
+            'title': {'text': title_map[group][2]},  # Right y-axis title
+            'overlaying': 'y',
+            'side': 'right'
+        }
     
-    return (fig)
+    return figure_dict(traces, layout)
 
 
 #Plotting functions for card 4
@@ -295,8 +280,9 @@ def plot_sector_weightings():
 
 def plot_sector_risk_returns(animate = True):
     results = []
+    risk_returns = get_sector_risk_returns(list(SECTOR_ETFS.values()))
     for sector, ticker in SECTOR_ETFS.items():
-        quarterly_df = get_quarterly_annualized_risk_return(ticker)
+        quarterly_df = risk_returns[ticker]
         
         quarterly_df['Sector'] = sector
         quarterly_df['ETF'] = ticker
@@ -337,4 +323,66 @@ def plot_sector_risk_returns(animate = True):
     fig = format_graphs(fig)
     fig.update_layout(showlegend=False)
     return fig
-        
\ No newline at end of file
+        
+
+
+#Precomputed figures
+# Cache key of a figure, memcached keys can't contain spaces
+def figure_key(name, *args):
+    parts = ['+'.join(arg) if isinstance(arg, list) else str(arg) for arg in args]
+    return '_'.join(['figure', name] + parts).replace(' ', '-')
+
+# Bar charts don't use the rolling average, so every window shares one figure
+def metric_figure_key(metric_name, num_years, num_periods, bar):
+    return figure_key('metric', metric_name, num_years, 1 if bar else num_periods, 'bar' if bar else 'line')
+
+def sector_figure_key(ticker, num_years, num_periods):
+    return figure_key('sector', ticker, num_years, num_periods)
+
+# The interest rate traces depend on the maturities (and their order), only the default checklist is precomputed
+def macro_figure_key(group, num_years, maturity=DEFAULT_MATURITY):
+    return figure_key('macro', group, num_years, maturity if group == 'interest_rates' else [])
+
+# (key, render) for every precomputed figure
+def figure_matrix():
+    figures = []
+    for num_years in FIGURE_TIMEFRAMES:
+        for metric_name in METRIC_MAPPINGS:
+            figures.append((metric_figure_key(metric_name, num_years, 1, True), lambda m=metric_name, y=num_years: plot_metric(m, y, 1, True)))
+            for num_periods in FIGURE_ROLLING_WINDOWS:
+                figures.append((metric_figure_key(metric_name, num_years, num_periods, False), lambda m=metric_name, y=num_years, p=num_periods: plot_metric(m, y, p, False)))
+        for ticker in SECTOR_ETFS.values():
+            for num_periods in FIGURE_ROLLING_WINDOWS:
+                figures.append((sector_figure_key(ticker, num_years, num_periods), lambda t=ticker, y=num_years, p=num_periods: plot_sector_data(t, y, p)))
+        for group in MACRO_TRACE_DICT:
+            figures.append((macro_figure_key(group, num_years), lambda g=group, y=num_years: plot_macroeconomic_data(g, y)))
+    return figures
+
+# Renders the figure matrix into generation from that generation's data. A figure that fails to render or is not
+# stored is left out and rendered live when it is requested. Returns the keys of the figures left out
+def refresh_figures(generation):
+    missing = []
+    with building_generation(generation):
+        for key, render in figure_matrix():
+            try:
+                stored = cache_set_json(generation_key(key), to_json_plotly(render()), CACHE_HARD_TTL)
+            except Exception:
+                logger.exception("Rendering %s failed", key)
+                stored = False
+            if not stored:
+                missing.append(key)
+    return missing
+
+# Figure dict, precomputed when there is one, otherwise rendered live
+def get_figure(key, render):
+    figure = cache_get_json(generation_key(key))
+    return figure if figure is not None else render()
+
+def get_metric_figure(metric_name, num_years=2, num_periods=1, bar=False):
+    return get_figure(metric_figure_key(metric_name, num_years, num_periods, bar), lambda: plot_metric(metric_name, num_years, num_periods, bar))
+
+def get_sector_figure(ticker, num_years=1, num_periods=7):
+    return get_figure(sector_figure_key(ticker, num_years, num_periods), lambda: plot_sector_data(ticker, num_years, num_periods))
+
+def get_macroeconomic_figure(group, num_years, maturity=DEFAULT_MATURITY):
+    return get_figure(macro_figure_key(group, num_years, maturity), lambda: plot_macroeconomic_data(group, num_years, maturity))
@@ -1,43 +1,52 @@
-import os
-from urllib.parse import urlparse
-import bmemcached
+import logging
+import sys
+import pandas as pd
 
+from cache import new_generation, publish_generation
 from data_update import update_sector_data
-from load_data import load_macro_data, create_watchlist_df, get_quarterly_annualized_risk_return
-from utilities import MACRO_TRACE_DICT, ETF_TO_SECTOR
+from database import get_pool_stats
+from load_data import MACRO_CACHE_YEARS, refresh_macro_data, refresh_watchlist_data, refresh_sector_risk_returns, update_sp500_constituents
+from plotting import figure_matrix, refresh_figures
+from utilities import ETF_TO_SECTOR
 
-
-mc = bmemcached.Client(os.environ.get('MEMCACHEDCLOUD_SERVERS').split(','), os.environ.get('MEMCACHEDCLOUD_USERNAME'), os.environ.get('MEMCACHEDCLOUD_PASSWORD'))
+logger = logging.getLogger(__name__)
 
 
 def run_data_jobs():
     # Update ETF data in RDS
-    update_sector_data()
-
-    # Load and cache macro data
-    for group in MACRO_TRACE_DICT.keys():
-        cache_key = f'cache_key_{group}'
-        cached_data = mc.get(cache_key)
-        if cached_data is not None:
-            mc.delete(cache_key)
-        load_macro_data(group, 4)
+    update_summary = update_sector_data()
+    print(pd.DataFrame(update_summary).to_string(index=False))
+
+    # Build a complete new cache generation next to the one being served, then switch readers over in one step
+    generation = new_generation()
+
+    # Load and cache macro data for every group in one pass
+    refresh_macro_data(MACRO_CACHE_YEARS, generation)
     
-    # Load and cache stock data
-    cache_key = 'daily_stock_data'
-    cached_data = mc.get(cache_key)
-    if cached_data is not None:
-        mc.delete(cache_key)
-    create_watchlist_df()
+    # Refresh the stale watchlist field groups and cache the watchlist
+    print(refresh_watchlist_data(generation))
 
     # Load and cache sector risk/return
-    for ticker in ETF_TO_SECTOR.keys():
-        cache_key = f'risk_return_{ticker}'
-        cached_data = mc.get(cache_key)
-        if cached_data is not None:
-            mc.delete(cache_key)
-        get_quarterly_annualized_risk_return(ticker)
+    refresh_sector_risk_returns(list(ETF_TO_SECTOR.keys()), generation)
+
+    # Render every Market Overview and macro figure from the new generation's data
+    missing = refresh_figures(generation)
+    print(f"{len(figure_matrix()) - len(missing)} figures rendered")
+    # A missing figure is rendered live on request, so it doesn't hold back the refreshed data
+    if missing:
+        logger.warning("%d figures not stored in generation %s: %s", len(missing), generation, ', '.join(missing))
+
+    publish_generation(generation)
 
     return
 
+# Scheduled separately (weekly is plenty), the nightly jobs read the stored constituent list
+def run_constituent_job():
+    print(update_sp500_constituents())
+
 if __name__ == '__main__':
-    run_data_jobs()
+    if len(sys.argv) > 1 and sys.argv[1] == 'constituents':
+        run_constituent_job()
+    else:
+        run_data_jobs()
+    print(get_pool_stats())
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules read their service settings at import time, tests never connect to any of them
+os.environ.setdefault('MEMCACHEDCLOUD_SERVERS', '127.0.0.1:11211')
+os.environ.setdefault('FRED_API_KEY', 'test')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
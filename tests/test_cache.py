@@ -0,0 +1,292 @@
+import threading
+from time import monotonic, sleep
+
+import numpy as np
+import pandas as pd
+import pytest
+from dash.exceptions import PreventUpdate
+from flask import Flask
+
+import cache
+from cache import cache_get_or_build
+
+
+# In-memory stand-in for the bmemcached client, refusing values listed in too_large like memcached's item size limit
+class MemoryClient:
+    def __init__(self, too_large=()):
+        self.values = {}
+        self.too_large = set(too_large)
+        self.lock = threading.Lock()
+        self.gets = []
+
+    def get(self, key):
+        self.gets.append(key)
+        return self.values.get(key)
+
+    def set(self, key, value, time=0, compress_level=-1):
+        if key in self.too_large:
+            return False
+        self.values[key] = value
+        return True
+
+    def add(self, key, value, time=0, compress_level=-1):
+        with self.lock:
+            if key in self.values:
+                return False
+            self.values[key] = value
+            return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+        return True
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = MemoryClient()
+    monkeypatch.setattr(cache, 'mc', client)
+    monkeypatch.setattr(cache, 'published_generation', (None, 0.0))
+    monkeypatch.setattr(cache, 'local_cache', cache.LocalCache())
+    monkeypatch.setattr(cache, 'CACHE_LEASE_WAIT', 0.3)
+    monkeypatch.setattr(cache, 'CACHE_LEASE_POLL', 0.05)
+    return client
+
+
+def counting_build(calls):
+    def build():
+        calls.append(1)
+        return pd.DataFrame({'value': [1.0, 2.0]})
+    return build
+
+
+def test_builds_stores_and_releases_the_lease(client):
+    calls = []
+    df = cache_get_or_build('frame', counting_build(calls))
+
+    assert calls == [1]
+    assert 'frame:lease' not in client.values
+    pd.testing.assert_frame_equal(cache.cache_get_frame('frame'), df)
+    cache_get_or_build('frame', counting_build(calls))
+    assert calls == [1]
+
+
+def test_request_waiter_gives_up_without_building(client):
+    # Another process is in the middle of a long rebuild
+    client.add('frame:lease', 'other')
+    calls = []
+
+    start = monotonic()
+    with Flask(__name__).test_request_context():
+        with pytest.raises(PreventUpdate):
+            cache_get_or_build('frame', counting_build(calls))
+
+    assert calls == []
+    assert 0.3 <= monotonic() - start < 2
+
+
+def test_job_waiter_takes_over_when_the_lease_is_gone(client):
+    client.add('frame:lease', 'other')
+    calls = []
+
+    # The holder died, its lease expires past CACHE_LEASE_WAIT
+    threading.Timer(0.5, client.delete, ['frame:lease']).start()
+    start = monotonic()
+    df = cache_get_or_build('frame', counting_build(calls))
+
+    assert calls == [1]
+    assert monotonic() - start >= 0.5
+    assert list(df['value']) == [1.0, 2.0]
+    assert 'frame:lease' not in client.values
+
+
+def test_waiter_returns_the_holders_value(client):
+    client.add('frame:lease', 'other')
+    calls = []
+
+    def finish():
+        cache.cache_set_frame('frame', pd.DataFrame({'value': [3.0]}))
+        client.delete('frame:lease')
+
+    threading.Timer(0.1, finish).start()
+    with Flask(__name__).test_request_context():
+        df = cache_get_or_build('frame', counting_build(calls))
+
+    assert calls == []
+    assert list(df['value']) == [3.0]
+
+
+def test_unstored_value_keeps_the_lease(client):
+    client.too_large.update({'frame', 'frame:previous'})
+    calls = []
+
+    cache_get_or_build('frame', counting_build(calls))
+    assert 'frame:lease' in client.values
+
+    # The next caller doesn't take the lease and rebuild the value in turn
+    with Flask(__name__).test_request_context():
+        with pytest.raises(PreventUpdate):
+            cache_get_or_build('frame', counting_build(calls))
+    assert calls == [1]
+
+
+def test_failed_build_releases_the_lease(client):
+    def build():
+        raise RuntimeError('upstream down')
+
+    with pytest.raises(RuntimeError):
+        cache_get_or_build('frame', build)
+    assert 'frame:lease' not in client.values
+
+
+def test_failed_background_refresh_logs_the_traceback(client, caplog):
+    def build():
+        raise RuntimeError('upstream down')
+
+    cache.cache_refresh_in_background('frame', build)
+    deadline = monotonic() + 2
+    while not caplog.records and monotonic() < deadline:
+        sleep(0.01)
+
+    [record] = caplog.records
+    assert record.levelname == 'ERROR'
+    assert record.exc_info[0] is RuntimeError
+    assert 'frame:lease' in client.values
+
+
+def test_local_hits_reread_the_generation_only_every_check_interval(client, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_GENERATION_CHECK', 0.2)
+    cache.publish_generation('1')
+    calls = []
+    frame = frame_function(calls)
+
+    app = Flask(__name__)
+    with app.test_request_context():
+        frame()
+    client.gets.clear()
+    for _ in range(3):
+        with app.test_request_context():
+            frame()
+    assert client.gets == []
+
+    # Another process publishes, this one picks it up once the check interval has passed
+    client.set(cache.CACHE_GENERATION_KEY, '2')
+    with app.test_request_context():
+        assert cache.current_generation() == '1'
+    sleep(0.2)
+    with app.test_request_context():
+        assert cache.current_generation() == '2'
+        frame()
+    assert calls == [1, 1]
+    assert client.gets.count(cache.CACHE_GENERATION_KEY) == 1
+
+
+@pytest.mark.parametrize('df', [
+    pd.DataFrame({'close': [1.5, np.nan, 3.25], 'volume': [1, 2, 3], 'flag': [True, False, True]},
+                 index=pd.DatetimeIndex(['2024-01-02', '2024-01-03', '2024-01-05'], name='datetime_index')),
+    pd.DataFrame({'Ticker': ['AAPL', 'MSFT', 'XOM'], 'PE Ratio': [31.2, 'N/A', 12], 'Beta': ['N/A', 0.9, None]}),
+    pd.DataFrame({'value': [1.0, 2.0]}, index=pd.RangeIndex(10, 14, 2)),
+    pd.DataFrame(),
+    pd.DataFrame({'close': pd.Series([], dtype=float)}, index=pd.DatetimeIndex([], name='datetime_index')),
+    pd.DataFrame([[1.0, 2.0, 'a'], [3.0, 4.0, 'b']], columns=['x', 'x', 'y']),
+], ids=['datetime_index', 'mixed_object', 'range_index', 'empty', 'no_rows', 'duplicate_columns'])
+def test_frame_round_trip(df):
+    decoded, refresh_at = cache.decode_entry(cache.encode_frame(df, refresh_at=1700000000.5))
+
+    pd.testing.assert_frame_equal(decoded, df)
+    assert refresh_at == 1700000000.5
+
+
+def test_decoded_frame_is_writable():
+    df = cache.decode_frame(cache.encode_frame(pd.DataFrame({'value': [1.0, 2.0]})))
+    df.iloc[0, 0] = 5.0
+    assert df['value'].tolist() == [5.0, 2.0]
+
+
+@pytest.mark.parametrize('payload', [
+    'datetime_index,close\n2024-01-02,1.5\n',
+    b'datetime_index,close\n2024-01-02,1.5\n',
+    cache.CACHE_MAGIC + bytes([cache.CACHE_FORMAT_VERSION + 1]) + b'\x00' * 16,
+    cache.JSON_MAGIC + bytes([cache.CACHE_FORMAT_VERSION]) + b'\x00' * 16,
+    None,
+], ids=['csv_string', 'csv_bytes', 'other_version', 'json_entry', 'missing'])
+def test_other_formats_decode_as_a_miss(payload):
+    assert cache.decode_entry(payload) is None
+    assert cache.decode_frame(payload) is None
+
+
+def test_old_csv_entry_is_rebuilt(client):
+    client.set('frame', 'value\n1.0\n')
+    calls = []
+
+    df = cache_get_or_build('frame', counting_build(calls))
+
+    assert calls == [1]
+    pd.testing.assert_frame_equal(cache.cache_get_frame('frame'), df)
+
+
+def frame_function(calls, key_format='frame'):
+    function = cache.CachedFunction(counting_build(calls), key_format)
+    cache.cached_functions.remove(function)
+    return function
+
+
+def test_request_keeps_its_generation_when_another_is_published(client, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_GENERATION_CHECK', 0)
+    frame = frame_function([])
+    frame.store(pd.DataFrame({'value': [1.0]}), generation='1')
+    frame.store(pd.DataFrame({'value': [2.0]}), generation='2')
+    cache.publish_generation('1')
+
+    app = Flask(__name__)
+    with app.test_request_context():
+        assert frame()['value'].tolist() == [1.0]
+        client.set(cache.CACHE_GENERATION_KEY, '2')
+        assert cache.current_generation() == '1'
+        assert frame()['value'].tolist() == [1.0]
+    with app.test_request_context():
+        assert frame()['value'].tolist() == [2.0]
+
+
+def test_building_generation_reads_and_writes_the_unpublished_generation(client):
+    cache.publish_generation('1')
+    calls = []
+    frame = frame_function(calls)
+    frame.store(pd.DataFrame({'value': [1.0]}))
+
+    seen_elsewhere = []
+    with cache.building_generation('2'):
+        frame.store(pd.DataFrame({'value': [2.0]}))
+        assert frame()['value'].tolist() == [2.0]
+        with cache.building_generation('3'):
+            assert cache.current_generation() == '3'
+        assert cache.current_generation() == '2'
+        # The override belongs to the building thread only
+        thread = threading.Thread(target=lambda: seen_elsewhere.append(frame()['value'].tolist()))
+        thread.start()
+        thread.join()
+
+    assert seen_elsewhere == [[1.0]]
+    assert frame()['value'].tolist() == [1.0]
+    assert calls == []
+    assert cache.decode_frame(client.get('2:frame'))['value'].tolist() == [2.0]
+
+
+def test_local_cache_expires_entries_after_its_ttl():
+    local = cache.LocalCache(max_size=4, ttl=0.1)
+    local.set('a', 1)
+    assert local.get('a') == 1
+    sleep(0.1)
+    assert local.get('a') is None
+    assert 'a' not in local.entries
+
+
+def test_local_cache_evicts_the_least_recently_used_entry():
+    local = cache.LocalCache(max_size=2, ttl=60)
+    local.set('a', 1)
+    local.set('b', 2)
+    assert local.get('a') == 1
+    local.set('c', 3)
+
+    assert local.get('b') is None
+    assert local.get('a') == 1
+    assert local.get('c') == 3
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_update
+from data_update import calculate_indicators, compute_indicators, ticker_indicators, update_sector_dataframe, update_ticker
+
+INDICATOR_COLUMNS = ['close', 'volatility', 'div_yield', 'rsi', 'sharpe', 'ytd_pct']
+
+
+def make_price_history(start='2021-06-01', end='2024-03-29'):
+    index = pd.bdate_range(start=start, end=end)
+    rng = np.random.default_rng(7)
+    close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.012, len(index))))
+    quarter_end = pd.Series(index, index=index).groupby(index.to_period('Q')).transform('max') == index
+    return pd.DataFrame({'close': close, 'dividends': np.where(quarter_end, close * 0.004, 0.0)}, index=index)
+
+
+# The per-indicator functions compute_indicators replaced, applied in the order update_sector_dataframe used to
+def reference_indicators(df):
+    df = df.copy()
+    returns = df['close'].pct_change().dropna()
+    df['volatility'] = returns.rolling(window=21).std() * np.sqrt(252) * 100
+
+    df['div_yield'] = (df['dividends'] / df['close']).replace([np.inf, -np.inf], np.nan)
+
+    delta = df['close'].diff()
+    avg_gain = delta.where(delta > 0, 0).rolling(window=14, min_periods=14).mean()
+    avg_loss = (-delta.where(delta < 0, 0)).rolling(window=14, min_periods=14).mean()
+    df['rsi'] = 100 - (100 / (1 + avg_gain / avg_loss))
+
+    df['sharpe'] = (returns.rolling(window=21).mean() - 0.01) / returns.rolling(window=21).std()
+
+    df['ytd_pct'] = np.nan
+    end_of_year_prices = df.resample('Y').last()['close']
+    for year in end_of_year_prices.index.year[:-1]:
+        end_price_prev_year = end_of_year_prices[end_of_year_prices.index.year == year].values[0]
+        mask = (df.index.year == year + 1)
+        df.loc[mask, 'ytd_pct'] = (df.loc[mask, 'close'] / end_price_prev_year - 1) * 100
+    return df
+
+
+@pytest.fixture
+def history():
+    return make_price_history()
+
+
+# Stores the fully computed history up to cut and serves the rows after it as newly fetched prices
+def stub_storage(monkeypatch, history, cut):
+    stored = calculate_indicators(history)
+    stored = stored[stored.index <= cut]
+
+    def load_etf_df(column_name, tickers, start_date=None, end_date=None, columns=None):
+        df = stored
+        if start_date is not None:
+            df = df[df.index >= pd.Timestamp(start_date)]
+        if end_date is not None:
+            df = df[df.index <= pd.Timestamp(end_date)]
+        return df[columns].copy()
+
+    monkeypatch.setattr(data_update, 'load_etf_df', load_etf_df)
+    monkeypatch.setattr(data_update, 'load_etf_last_date', lambda ticker: stored.index[-1])
+    monkeypatch.setattr(data_update, 'fetch_etf_data', lambda ticker, start_date: history[history.index >= pd.Timestamp(start_date)].copy())
+
+
+@pytest.mark.parametrize('cut', [
+    '2022-07-15',  # mid-year
+    '2022-12-30',  # last trading day of a year, the new rows start a new year
+    '2023-01-02',  # first trading day of a year
+    '2023-01-20',  # warm-up window spans the year boundary
+    '2023-03-31',  # quarter end, a dividend row
+    '2024-03-28',  # a single new row
+])
+def test_incremental_update_matches_full_recompute(monkeypatch, history, cut):
+    stub_storage(monkeypatch, history, pd.Timestamp(cut))
+
+    updated = update_sector_dataframe('XLK')
+
+    expected = ticker_indicators(compute_indicators(history[['close']], history[['dividends']].set_axis(['close'], axis=1)), 'close')
+    expected = expected[expected.index > pd.Timestamp(cut)]
+    assert len(updated) == len(expected) > 0
+    pd.testing.assert_frame_equal(updated[INDICATOR_COLUMNS], expected[INDICATOR_COLUMNS], check_freq=False, rtol=1e-9)
+
+
+def test_ticker_missing_from_the_batch_is_fetched_on_its_own(monkeypatch, history):
+    cut = pd.Timestamp('2024-03-01')
+    stub_storage(monkeypatch, history, cut)
+    saved = []
+    monkeypatch.setattr(data_update, 'save_etf_data', lambda df, ticker: saved.append(df))
+
+    # yf.download returns an all-NaN column for a ticker it failed to fetch
+    dates = history.index[history.index >= cut]
+    prices = pd.concat({'close': pd.DataFrame({'XLK': np.nan, 'XLE': 1.0}, index=dates),
+                        'dividends': pd.DataFrame({'XLK': np.nan, 'XLE': 0.0}, index=dates)}, axis=1)
+    summary = update_ticker('XLK', prices, attempts=2, backoff=0)
+
+    assert summary['status'] == 'ok'
+    assert summary['attempts'] == 2
+    assert summary['rows'] == len(saved[0]) == (history.index > cut).sum()
+
+
+def test_calculate_indicators_matches_the_reference_formulas(history):
+    # A zero close makes the dividend yield infinite, which both replace with NaN
+    history.iloc[300, history.columns.get_loc('close')] = 0.0
+
+    pd.testing.assert_frame_equal(calculate_indicators(history)[INDICATOR_COLUMNS], reference_indicators(history)[INDICATOR_COLUMNS],
+                                  check_freq=False, rtol=1e-9)
+
+
+def test_compute_indicators_matches_the_reference_per_ticker(history):
+    # Tickers with different first dates share one date x ticker matrix
+    later = make_price_history(start='2022-03-15') * 0.5
+    close = pd.concat({'XLK': history['close'], 'XLE': later['close']}, axis=1)
+    dividends = pd.concat({'XLK': history['dividends'], 'XLE': later['dividends']}, axis=1)
+
+    indicators = compute_indicators(close, dividends)
+
+    for ticker, prices in [('XLK', history), ('XLE', later)]:
+        pd.testing.assert_frame_equal(ticker_indicators(indicators, ticker)[INDICATOR_COLUMNS], reference_indicators(prices)[INDICATOR_COLUMNS],
+                                      check_freq=False, rtol=1e-9)
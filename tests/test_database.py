@@ -0,0 +1,80 @@
+import struct
+
+import numpy as np
+import pytest
+
+from database import read_binary_columns
+
+SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+POSTGRES_EPOCH_US = 946684800 * 10**6
+
+
+# Binary COPY file as Postgres writes it: header, one tuple per row of (length, big-endian value) fields, trailer
+def pgcopy(rows, extension=b''):
+    data = SIGNATURE + struct.pack('>ii', 0, len(extension)) + extension
+    for row in rows:
+        data += struct.pack('>h', len(row))
+        for value in row:
+            data += struct.pack('>i', -1) if value is None else struct.pack('>i', len(value)) + value
+    return data + struct.pack('>h', -1)
+
+def int4(value):
+    return struct.pack('>i', value)
+
+def float8(value):
+    return struct.pack('>d', value)
+
+def timestamp(value):
+    return struct.pack('>q', (np.datetime64(value, 'us').astype('int64') - POSTGRES_EPOCH_US))
+
+
+# Stands in for a psycopg2 connection, COPY writes the prepared payload
+class CopyConnection:
+    def __init__(self, payload):
+        self.payload = payload
+        self.queries = []
+
+    def cursor(self):
+        return self
+
+    def mogrify(self, query, params):
+        return (query % tuple(repr(param) for param in params or [])).encode()
+
+    def copy_expert(self, query, buffer):
+        self.queries.append(query)
+        buffer.write(self.payload)
+
+    def close(self):
+        pass
+
+
+def test_decodes_fixed_width_columns():
+    conn = CopyConnection(pgcopy([
+        [int4(2), timestamp('2024-01-02'), float8(23.45)],
+        [int4(1), timestamp('1999-12-31T23:59:59.5'), float8(float('nan'))],
+        [int4(-7), timestamp('2024-03-29T16:00'), float8(-1e300)],
+    ], extension=b'\x00' * 6))
+
+    positions, index, values = read_binary_columns(conn, "SELECT a FROM t WHERE b = %s", ['x'], ['int4', 'timestamp', 'float8'])
+
+    assert conn.queries == ["COPY (SELECT a FROM t WHERE b = 'x') TO STDOUT (FORMAT binary)"]
+    np.testing.assert_array_equal(positions, [2, 1, -7])
+    np.testing.assert_array_equal(index, np.array(['2024-01-02', '1999-12-31T23:59:59.5', '2024-03-29T16:00'], dtype='datetime64[ns]'))
+    np.testing.assert_array_equal(values, [23.45, np.nan, -1e300])
+    assert index.dtype == np.dtype('datetime64[ns]')
+    assert values.dtype == np.dtype('float64') and values.dtype.isnative
+
+
+def test_empty_result():
+    index, values = read_binary_columns(CopyConnection(pgcopy([])), "SELECT a FROM t", None, ['timestamp', 'float8'])
+    assert len(index) == len(values) == 0
+
+
+@pytest.mark.parametrize('rows', [
+    [[timestamp('2024-01-02'), float8(1.0)], [timestamp('2024-01-03'), None]],
+    [[timestamp('2024-01-02'), None], [timestamp('2024-01-03'), float8(1.0)]],
+    [[timestamp('2024-01-02'), int4(1)], [timestamp('2024-01-03'), int4(2)]],
+], ids=['null_last_row', 'null_first_row', 'wrong_type'])
+def test_rejects_nulls_and_other_types(rows):
+    with pytest.raises(ValueError):
+        read_binary_columns(CopyConnection(pgcopy(rows)), "SELECT a FROM t", None, ['timestamp', 'float8'])
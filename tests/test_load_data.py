@@ -0,0 +1,70 @@
+import socket
+
+import pandas as pd
+import pytest
+
+import load_data
+from load_data import fetch_etf_data, fetch_etf_data_batch, update_watchlist_table
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    def no_network(*args, **kwargs):
+        raise AssertionError("network access attempted")
+    monkeypatch.setattr(socket.socket, 'connect', no_network)
+    monkeypatch.setattr(load_data, 'PRICE_PROVIDER', 'fake')
+
+
+def test_fake_provider_batch_columns_and_dates(offline):
+    tickers = ['XLK', 'XLE', 'S&P 500', 'BRK.B']
+    df = fetch_etf_data_batch(tickers, '2023-01-01')
+
+    assert list(df.columns) == [(field, ticker) for field in ['close', 'dividends'] for ticker in tickers]
+    expected_dates = pd.bdate_range(start='2023-01-01', end=pd.Timestamp.now().normalize())
+    pd.testing.assert_index_equal(df.index, pd.DatetimeIndex(expected_dates), check_names=False)
+    assert df.notna().all().all()
+    assert (df['close'] > 0).all().all()
+    # Dividends are paid on the last generated day of each quarter only
+    paid = df.index[(df['dividends'] > 0).all(axis=1)]
+    quarter_ends = df.index.to_series().groupby(df.index.to_period('Q')).max()
+    pd.testing.assert_index_equal(paid, pd.DatetimeIndex(quarter_ends.values))
+
+
+def test_fake_provider_is_deterministic_per_ticker(offline):
+    batch = fetch_etf_data_batch(['XLK', 'XLE'], '2024-01-01')
+    single = fetch_etf_data('XLE', '2024-01-01')
+
+    pd.testing.assert_frame_equal(single, batch.xs('XLE', axis=1, level=1), check_freq=False)
+    assert not batch['close']['XLK'].equals(batch['close']['XLE'])
+
+
+def test_watchlist_identity_is_only_saved_when_the_quote_summary_has_one(monkeypatch):
+    info = {
+        'AAPL': {'Name': 'Apple Inc.', 'Sector': 'Technology', 'Beta': 1.2},
+        'MSFT': {'Name': 'N/A', 'Sector': 'Unknown', 'Beta': 'N/A'},  # throttled
+        'XOM': {'Name': 'N/A', 'Sector': 'Unknown', 'Beta': 'N/A'},  # throttled, already stored
+    }
+
+    def fetch_stock_data(ticker):
+        row = {col: 'N/A' for col in load_data.WATCHLIST_COLUMNS if col not in load_data.PRICE_HISTORY_COLUMNS}
+        return {**row, 'Ticker': ticker, **info[ticker]}
+
+    refresh_times = pd.DataFrame({'identity_updated_at': [pd.Timestamp('2024-01-01')], 'fundamentals_updated_at': [pd.NaT],
+                                  'prices_updated_at': [pd.NaT]}, index=pd.Index(['XOM'], name='ticker'))
+    saved = []
+    monkeypatch.setattr(load_data, 'fetch_stock_data', fetch_stock_data)
+    monkeypatch.setattr(load_data, 'load_watchlist_refresh_times', lambda: refresh_times)
+    monkeypatch.setattr(load_data, 'save_watchlist_rows', lambda df: saved.append(df))
+    monkeypatch.setattr(load_data, 'calculate_watchlist_price_columns',
+                        lambda tickers: pd.DataFrame(1.0, index=tickers, columns=load_data.PRICE_HISTORY_COLUMNS))
+    monkeypatch.setattr(load_data, 'delete_watchlist_rows_except', lambda tickers: None)
+
+    summary = update_watchlist_table(['AAPL', 'MSFT', 'XOM'])
+
+    new_rows, fundamentals, prices = saved
+    assert new_rows['ticker'].tolist() == ['AAPL']
+    assert new_rows['identity_updated_at'].notna().all()
+    assert fundamentals.empty
+    # MSFT has no row yet, so its prices wait for its identity
+    assert sorted(prices['ticker']) == ['AAPL', 'XOM']
+    assert summary == {'identity': 1, 'fundamentals': 0, 'prices': 2}
@@ -0,0 +1,178 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+import pytest
+from plotly.io.json import to_json_plotly
+
+import plotting
+from database import ETF_COLUMNS
+from plotting import METRIC_MAPPINGS, plot_bar_graph, plot_line_graph, plot_macroeconomic_data, plot_sector_data
+from utilities import ETF_TO_SECTOR, MACRO_TRACE_DICT, get_interest_rates_columns
+
+TICKERS = ['XLB', 'XLC', 'XLE', 'XLK', 'XLV', 'S&P 500']
+
+
+# Two and a half years of business days up to today, so every timeframe crosses year boundaries, with a few gaps
+def make_frame(columns, seed=3):
+    index = pd.bdate_range(end=datetime.now().date(), periods=650)
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.normal(1, 0.3, (len(index), len(columns))).cumsum(axis=0), index=index, columns=columns)
+    df.iloc[5:9, 0] = np.nan
+    df.iloc[-3:, 1] = np.nan
+    return df
+
+
+# The go.Figure implementation the figure dicts replaced, kept as the reference for their JSON
+def old_draw_year_dividers(fig, df):
+    df.index = pd.to_datetime(df.index)
+    for year in df.index.year.unique():
+        first_day_of_year = df[df.index.year == year].index.min()
+        fig.add_shape(type="line", x0=first_day_of_year, x1=first_day_of_year, yref="paper", y0=0, y1=1,
+                      line=dict(color='black', width=1.25, dash='dash'), layer="above")
+    return fig
+
+def old_format_graphs(fig):
+    fig.update_layout(
+        legend={'orientation': 'v'},
+        margin={'l': 20, 'r': 20, 't': 30, 'b': 1},
+        plot_bgcolor='rgb(255,255,255)',
+        yaxis={'visible': True, 'gridcolor': 'rgb(200,200,200)', 'linecolor': 'black', 'zeroline': True, 'zerolinecolor': 'rgb(150,150,150)'},
+        xaxis={'visible': True, 'linecolor': 'black', 'showgrid': True, 'gridcolor': 'rgb(200,200,200)', 'zeroline': True, 'zerolinecolor': 'black'},
+    )
+    return fig
+
+def old_line_graph(df, metric_name):
+    default_not_visible = ['XLC', 'XLP', 'XLV', 'XLY', 'XLB']
+    fig = go.Figure()
+    for column in df.columns:
+        sector_name = ETF_TO_SECTOR.get(column, column)
+        fig.add_trace(go.Scatter(x=df.index, y=df[column], mode='lines', name=column,
+                                 visible='legendonly' if column in default_not_visible else True,
+                                 hovertemplate=f'{sector_name}: %{{y:.2f}}<extra></extra>'))
+    fig.update_layout(title=f"{metric_name} by Sector", yaxis_title=metric_name, autosize=True)
+    fig = old_draw_year_dividers(fig, df)
+    fig.update_layout(hovermode="x unified")
+    return old_format_graphs(fig)
+
+def old_bar_graph(df, metric_name):
+    etf_performance = df.iloc[-1]
+    benchmark_name = 'S&P 500'
+    if 'S&P 500' in df.columns:
+        benchmark_value = etf_performance['S&P 500']
+        etf_performance.drop(labels='S&P 500', inplace=True)
+    else:
+        benchmark_value = etf_performance.mean()
+        benchmark_name = f"Average {metric_name}"
+    min_ticker = etf_performance.idxmin()
+
+    fig = go.Figure(go.Bar(x=etf_performance.index, y=etf_performance.values,
+                           text=[ETF_TO_SECTOR.get(ticker, ticker) for ticker in etf_performance.index],
+                           name='ETF Cumulative Performance', marker=dict(color='blue'), hoverinfo="x+text+y"))
+    fig.add_shape(type="line", x0=-0.5, x1=len(etf_performance) - 0.5, y0=benchmark_value, y1=benchmark_value,
+                  line=dict(color="red", width=2), name=benchmark_name)
+    fig.add_annotation(x=etf_performance.index.get_loc(min_ticker), y=benchmark_value, text=benchmark_name,
+                       showarrow=True, yshift=10, font=dict(color="red"), arrowhead=2)
+    fig.update_layout(title=f"{metric_name} by Sector", xaxis_title='Ticker', yaxis_title=metric_name,
+                      yaxis=dict(showgrid=True, gridcolor='rgb(200,200,200)'), plot_bgcolor='rgb(255,255,255)',
+                      autosize=True, margin=dict(l=20, r=20, t=30, b=30))
+    return fig
+
+# Baseline plot_sector_data: every stored column of the ticker's table in table order, dividends dropped
+def old_sector_data(stored, ticker, num_years, num_periods):
+    df = stored.drop(columns=['dividends'])
+    if num_periods > 1:
+        df = df.rolling(window=num_periods, min_periods=1).mean()
+    column_mappings = {value: key for key, value in METRIC_MAPPINGS.items()}
+    df = df[df.index >= datetime(datetime.now().year - num_years, 1, 1)]
+
+    fig = go.Figure()
+    for column in df.columns:
+        if column == 'sharpe':
+            continue
+        fig.add_trace(go.Scatter(x=df.index, y=df[column], mode='lines', name=column_mappings[column]))
+    fig.add_trace(go.Scatter(x=df.index, y=df['sharpe'], mode='lines', name='Sharpe Ratio', yaxis='y2'))
+    fig.update_layout(title=f'{ticker} Sector Data', yaxis=dict(title='Primary Metrics', side='left'),
+                      yaxis2=dict(title='Sharpe Ratio', overlaying='y', side='right'), autosize=True)
+    fig = old_draw_year_dividers(fig, df)
+    fig = old_format_graphs(fig)
+    fig.update_layout(legend={'orientation': 'h', 'yanchor': 'top'})
+    fig.update_layout(hovermode="x unified")
+    return fig
+
+def old_macro_graph(df, group, lines, bars):
+    fig = go.Figure()
+    for trace in lines:
+        if trace.axis2 == False:
+            fig.add_trace(go.Scatter(x=df.index, y=df[trace.name], mode='lines', name=trace.name,
+                                     visible='legendonly' if trace.hidden else True, zorder=1))
+    for trace in lines:
+        if trace.axis2:
+            fig.add_trace(go.Scatter(x=df.index, y=df[trace.name], mode='lines', name=trace.name, yaxis='y2',
+                                     visible='legendonly' if trace.hidden else True, zorder=1))
+    for trace in bars:
+        fig.add_trace(go.Bar(x=df.index, y=df[trace.name], name=trace.name, yaxis='y2', marker_color='lightgrey'))
+
+    title_map = {
+        'economic_growth': ['Economic Growth and Consumer Sentiment Indicators', 'Values', 'CCI'],
+        'labor_market': ['Labor Market Indicators', 'Unemployment Rate (%)', 'Nonfarm Payrolls 1M Change'],
+        'inflation_prices': ['Inflation and Prices Indicators', 'YoY Change (%)', 'Absolute Value'],
+        'housing_market': ['Housing Market Indicators', 'YoY Change (%)', 'Absolute Value'],
+        'interest_rates': ['Interest Rates, Yield Spreads, and Monetary Indicators', 'Rate (%)']
+    }
+    fig = old_draw_year_dividers(fig, df)
+    fig = old_format_graphs(fig)
+    fig.update_layout(title=title_map[group][0], yaxis=dict(title=title_map[group][1]),
+                      legend=dict(orientation='h', x=0.5, y=-0.1, xanchor='center', yanchor='top', traceorder='normal'))
+    if len(title_map[group]) > 2:
+        fig.update_layout(yaxis2=dict(title=title_map[group][2], overlaying='y', side='right'))
+    return fig
+
+
+@pytest.mark.parametrize('metric_name', ['Price', 'RSI'])
+def test_line_graph_matches_go_figure(metric_name):
+    df = make_frame(TICKERS)
+    assert to_json_plotly(plot_line_graph(df.copy(), metric_name)) == old_line_graph(df.copy(), metric_name).to_json()
+
+
+@pytest.mark.parametrize('columns', [TICKERS, TICKERS[:-1]], ids=['benchmark', 'average'])
+def test_bar_graph_matches_go_figure(columns):
+    df = make_frame(columns)
+    assert to_json_plotly(plot_bar_graph(df.copy(), 'Volatility')) == old_bar_graph(df.copy(), 'Volatility').to_json()
+
+
+@pytest.mark.parametrize('num_years, num_periods', [(0, 1), (1, 5), (4, 20)])
+def test_sector_data_matches_go_figure(monkeypatch, num_years, num_periods):
+    stored = make_frame(ETF_COLUMNS)
+    loaded = []
+
+    def load_etf_df(column_name, tickers, start_date=None, columns=None):
+        df = stored if start_date is None else stored[stored.index >= pd.Timestamp(start_date)]
+        loaded.append(df)
+        return df[columns or ETF_COLUMNS].copy()
+
+    monkeypatch.setattr(plotting, 'load_etf_df', load_etf_df)
+    figure = plot_sector_data('XLK', num_years, num_periods)
+
+    # Plotly colours traces by position, so the legend order is part of what users see
+    assert [trace['name'] for trace in figure['data']] == ['Price', 'Volatility', 'Dividend Yield', 'RSI', 'Year-End Indexed Price', 'Sharpe Ratio']
+    # Same rows as the warm-up bounded read, a rolling mean started elsewhere differs in the last bits
+    assert to_json_plotly(figure) == old_sector_data(loaded[0], 'XLK', num_years, num_periods).to_json()
+
+
+@pytest.mark.parametrize('group, maturity', [(group, ['2 Year', '10 Year']) for group in MACRO_TRACE_DICT]
+                         + [('interest_rates', ['5 Year', '30 Year', '3 Month'])])
+def test_macro_graph_matches_go_figure(monkeypatch, group, maturity):
+    traces = MACRO_TRACE_DICT[group]
+    df = make_frame([trace.name for trace in traces])
+    monkeypatch.setattr(plotting, 'load_macro_data', lambda group, num_years: df.copy())
+
+    lines = [trace for trace in traces if trace.bar == False]
+    bars = [trace for trace in traces if trace.bar == True]
+    if group == 'interest_rates':
+        columns = get_interest_rates_columns(maturity)
+        lines = [trace for trace in traces if trace.name in columns]
+    expected = df[df.index >= datetime(datetime.now().year - 1, 1, 1)]
+
+    assert to_json_plotly(plot_macroeconomic_data(group, 1, maturity)) == old_macro_graph(expected.copy(), group, lines, bars).to_json()
@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utilities import PERIOD_CHANGES, calculate_period_change, calculate_yoy
+
+
+# The per-date loop calculate_period_change replaced, generalized from one year to any PERIOD_CHANGES entry
+def reference_period_change(series, period='yoy'):
+    offset, min_age = PERIOD_CHANGES[period]
+    series.index = pd.to_datetime(series.index)
+    change_series = pd.Series(index=series.index, dtype=float)
+
+    for current_date in series.index:
+        previous_date = current_date - offset
+
+        # Find the entry closest to one period ago
+        closest_date = series.index[series.index.get_indexer([previous_date], method='nearest')[0]]
+
+        if closest_date < current_date - min_age:
+            previous_value = series.loc[closest_date]
+            current_value = series.loc[current_date]
+            change_series.at[current_date] = ((current_value - previous_value) / previous_value) * 100
+
+    return change_series
+
+
+def with_gaps_and_nans(index, seed):
+    rng = np.random.default_rng(seed)
+    # Drop ~15% of the dates and blank out ~5% of the remaining values
+    index = index[rng.uniform(size=len(index)) > 0.15]
+    values = 100 + np.cumsum(rng.normal(0, 1, len(index)))
+    values[rng.uniform(size=len(index)) < 0.05] = np.nan
+    return pd.Series(values, index=index)
+
+
+SERIES = {
+    # Calendar days through two leap days, so Feb 29 lookbacks and month-end clipping are covered
+    'daily': with_gaps_and_nans(pd.date_range('2019-01-01', '2024-12-31', freq='D'), 1),
+    'business_daily': with_gaps_and_nans(pd.bdate_range('2019-01-01', '2024-12-31'), 2),
+    'weekly': with_gaps_and_nans(pd.date_range('2015-01-01', '2024-12-31', freq='W-THU'), 3),
+    'monthly': with_gaps_and_nans(pd.date_range('2010-01-01', '2024-12-01', freq='MS'), 4),
+    'month_end': with_gaps_and_nans(pd.date_range('2010-01-31', '2024-12-31', freq='M'), 5),
+    'quarterly': with_gaps_and_nans(pd.date_range('2000-01-01', '2024-10-01', freq='QS'), 6),
+    'zero_previous': pd.Series([0.0, 5.0, 0.0, 7.0], index=pd.to_datetime(['2020-01-01', '2020-07-01', '2021-01-01', '2022-01-01'])),
+    'single': pd.Series([3.0], index=pd.to_datetime(['2020-01-01'])),
+}
+
+
+@pytest.mark.parametrize('period', list(PERIOD_CHANGES))
+@pytest.mark.parametrize('name', list(SERIES))
+def test_period_change_matches_reference_loop(name, period):
+    series = SERIES[name]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = reference_period_change(series.copy(), period)
+    pd.testing.assert_series_equal(calculate_period_change(series.copy(), period), expected, check_freq=False)
+
+
+# Observations one day either side of every lookback target, so each one is an exact tie
+def tied_series(period, num_dates=12):
+    offset = PERIOD_CHANGES[period][0]
+    current_dates = [pd.Timestamp('2020-06-10') + timedelta(days=200 * i) for i in range(num_dates)]
+    dates = set(current_dates)
+    for current_date in current_dates:
+        dates.update([current_date - offset - timedelta(days=1), current_date - offset + timedelta(days=1)])
+    dates = sorted(dates)
+    return pd.Series(np.arange(1.0, len(dates) + 1), index=pd.DatetimeIndex(dates)), current_dates
+
+
+@pytest.mark.parametrize('period', list(PERIOD_CHANGES))
+def test_period_change_ties_match_reference_loop(period):
+    series, current_dates = tied_series(period)
+    result = calculate_period_change(series.copy(), period)
+    pd.testing.assert_series_equal(result, reference_period_change(series.copy(), period), check_freq=False)
+
+    # Ties go to the later observation
+    offset = PERIOD_CHANGES[period][0]
+    for current_date in current_dates:
+        later = series[current_date - offset + timedelta(days=1)]
+        assert result[current_date] == pytest.approx((series[current_date] - later) / later * 100)
+
+
+def test_calculate_yoy_is_the_yearly_period_change():
+    series = SERIES['monthly']
+    pd.testing.assert_series_equal(calculate_yoy(series.copy()), calculate_period_change(series.copy(), 'yoy'))
@@ -1,7 +1,9 @@
+import numpy as np
 import pandas as pd
 from collections import Counter
 from datetime import datetime, timedelta
 from dataclasses import dataclass
+import plotly.io as pio
 
 
 SECTOR_ETFS = {
@@ -160,72 +162,102 @@ def get_interest_rates_columns(maturity):
         return yields
     
 
-def calculate_yoy(series):
+# Period-over-period % change settings: the offset compared against, and the minimum age of the
+# matched observation so that sparse series never compare neighbouring points
+PERIOD_CHANGES = {
+    'yoy': (pd.DateOffset(years=1), timedelta(weeks=30)),
+    'qoq': (pd.DateOffset(months=3), timedelta(weeks=7)),
+    'mom': (pd.DateOffset(months=1), timedelta(days=15)),
+}
+
+# Compares every date with the observation nearest to one period earlier (ties go to the later one),
+# using one sorted search over the whole index instead of a lookup per date
+def calculate_period_change(series, period='yoy'):
+    offset, min_age = PERIOD_CHANGES[period]
     series.index = pd.to_datetime(series.index)
-    yoy_series = pd.Series(index=series.index, dtype=float)
-    
-    for current_date in series.index:
-        one_year_ago = current_date - pd.DateOffset(years=1)
-        
-        # Find the entry closest to one year ago
-        closest_date = series.index[series.index.get_indexer([one_year_ago], method='nearest')[0]]
-        
-        if closest_date < current_date - timedelta(weeks = 30):
-            previous_value = series.loc[closest_date]
-            current_value = series.loc[current_date]
+    dates = series.index.values
+    targets = (series.index - offset).values
+
+    # Last observation at or before the target and first observation at or after it (-1 when missing)
+    before = np.searchsorted(dates, targets, side='right') - 1
+    after = np.searchsorted(dates, targets, side='left')
+    after[after == len(dates)] = -1
+    before_distance = np.abs(dates[before] - targets)
+    after_distance = np.abs(dates[after] - targets)
+    closest = np.where((before_distance < after_distance) | (after == -1), before, after)
+
+    values = series.values.astype(float)
+    previous_values = values[closest]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = ((values - previous_values) / previous_values) * 100
+    has_previous = dates[closest] < dates - np.timedelta64(min_age)
+    return pd.Series(np.where(has_previous, change, np.nan), index=series.index, dtype=float)
+
+def calculate_yoy(series):
+    return calculate_period_change(series, 'yoy')
 
-            yoy_percent_change = ((current_value - previous_value) / previous_value) * 100
-            yoy_series.at[current_date] = yoy_percent_change
-    
-    return yoy_series
+
+# First date to load so a rolling window of num_periods trading days is fully warmed up at start_date
+def warmup_start_date(start_date, num_periods):
+    if num_periods <= 1:
+        return start_date
+    # ~5 trading days per 7 calendar days, plus slack for market holidays
+    return start_date - timedelta(days=(num_periods * 7) // 5 + 10)
 
 
 #Graph Tools
-def draw_year_dividers(fig, df):
-    df.index = pd.to_datetime(df.index)
-    for year in df.index.year.unique():
-        first_day_of_year = df[df.index.year == year].index.min()
-        fig.add_shape(
-            type="line",
-            x0=first_day_of_year,
-            x1=first_day_of_year,
-            yref="paper",  
-            y0=0,  
-            y1=1,  
-            line=dict(color='black', width=1.25, dash='dash'),
-            layer="above",  
-        )
-    return fig
+# Figures are assembled as plain figure dicts in the key order plotly itself produces, which skips plotly's
+# property validation and serializes to the same JSON as the equivalent go.Figure
+PLOTLY_TEMPLATE = pio.templates[pio.templates.default].to_plotly_json()
 
+GRAPH_MARGIN = {'l': 20, 'r': 20, 't': 30, 'b': 1}
+GRAPH_YAXIS = {
+    'visible': True,
+    'gridcolor': 'rgb(200,200,200)',
+    'linecolor': 'black',
+    'zeroline': True,
+    'zerolinecolor': 'rgb(150,150,150)',
+}
+GRAPH_XAXIS = {
+    'visible': True,
+    'linecolor': 'black',
+    'showgrid': True,
+    'gridcolor': 'rgb(200,200,200)',
+    'zeroline': True,
+    'zerolinecolor': 'black',
+}
+GRAPH_BGCOLOR = 'rgb(255,255,255)'
 
 def format_graphs(fig):
     fig.update_layout(
         legend = {
             'orientation': 'v',
         },
-        margin = {
-            'l': 20,
-            'r': 20,
-            't': 30,
-            'b': 1
-        },
-        plot_bgcolor = 'rgb(255,255,255)',
-        yaxis = {
-            'visible': True,
-            'gridcolor': 'rgb(200,200,200)',
-            'linecolor': 'black',
-            'zeroline': True,
-            'zerolinecolor': 'rgb(150,150,150)',
-        },
-        xaxis = {
-            'visible': True,
-            'linecolor': 'black',
-            'showgrid': True,
-            'gridcolor': 'rgb(200,200,200)',
-            'zeroline': True,
-            'zerolinecolor': 'black',
-        },
-
+        margin = GRAPH_MARGIN,
+        plot_bgcolor = GRAPH_BGCOLOR,
+        yaxis = GRAPH_YAXIS,
+        xaxis = GRAPH_XAXIS,
     )
 
-    return fig
\ No newline at end of file
+    return fig
+
+# Dashed vertical line at the first date of every year in index
+def year_divider_shapes(index):
+    index = pd.to_datetime(index)
+    years = index.year
+    first_days = index[np.r_[True, years[1:] != years[:-1]]] if len(index) else index
+    return [{
+        'layer': 'above',
+        'line': {'color': 'black', 'dash': 'dash', 'width': 1.25},
+        'type': 'line',
+        'x0': first_day,
+        'x1': first_day,
+        'y0': 0,
+        'y1': 1,
+        'yref': 'paper',
+    } for first_day in first_days]
+
+# Figure dict with the default template, layout keys keep their order and an empty shapes list is left out
+def figure_dict(data, layout):
+    layout = {'template': PLOTLY_TEMPLATE, **{key: value for key, value in layout.items() if not (key == 'shapes' and not value)}}
+    return {'data': data, 'layout': layout}
\ No newline at end of file